@@ -1,16 +1,34 @@
 # api/main.py
-import os 
+import os
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from routers import register, verify
+from routers import embedding, register, stream, verify
+from utils import config, metrics, model_registry
+from utils.executor import ServerBusy
 
 app = FastAPI(title="Face API v3.0", version="3.0")
 
 app.include_router(register.router, prefix="", tags=["register"])
 app.include_router(verify.router, prefix="", tags=["verify"])
+app.include_router(embedding.router, prefix="", tags=["embedding"])
+app.include_router(stream.router, prefix="", tags=["verify"])
+
+# Backend Node gọi các API dưới /api/... → mount thêm 1 bản (ẩn khỏi /docs)
+for r in (register.router, verify.router, embedding.router, stream.router):
+    app.include_router(r, prefix="/api", include_in_schema=False)
+
+@app.exception_handler(ServerBusy)
+async def server_busy(request: Request, exc: ServerBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.on_event("startup")
+def startup():
+    # Nạp YOLOFace + ArcFace 1 lần/process và chạy thử trước khi nhận request
+    model_registry.warmup()
 
 @app.get("/")
 def home():
@@ -20,5 +38,20 @@ def home():
 def health():
     return {"status": "healthy"}
 
+@app.get("/models")
+def models():
+    """Thời gian nạp, bộ nhớ của model trong worker hiện tại."""
+    return model_registry.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Metric Prometheus (text): thời gian từng bước verify, số mặt/unknown/fake, kích thước gallery."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
-    uvicorn.run("api.main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "api.main:app",
+        host=config.get("server", "host", "0.0.0.0"),
+        port=config.get("server", "port", 8000),
+        reload=True,
+    )
@@ -0,0 +1,39 @@
+# detector/postprocess.py
+import numpy as np
+
+SELECT_MODES = ("largest", "center", "confidence")
+
+
+def filter_faces(boxes, kpts=None, min_size=0, max_faces=0):
+    """
+    boxes (N×5 [x1, y1, x2, y2, conf]) → sắp giảm dần theo conf, bỏ mặt có cạnh ngắn < min_size px,
+    giữ tối đa max_faces mặt (0 = không giới hạn). kpts (N×5×2) được lọc theo cùng chỉ số.
+    """
+    order = np.argsort(-boxes[:, 4], kind="stable")
+    if min_size:
+        side = np.minimum(boxes[order, 2] - boxes[order, 0], boxes[order, 3] - boxes[order, 1])
+        order = order[side >= min_size]
+    if max_faces:
+        order = order[:max_faces]
+    return boxes[order], (kpts[order] if kpts is not None else None)
+
+
+def select_face(faces, frame_shape=None, mode="largest"):
+    """
+    Chỉ số khuôn mặt chính trong faces (N×5) thay cho faces[0]:
+    - largest    : diện tích lớn nhất (người đứng gần camera/tủ nhất)
+    - center     : tâm gần tâm khung hình nhất (cần frame_shape)
+    - confidence : conf cao nhất
+    Trả về -1 nếu không có mặt nào.
+    """
+    faces = np.asarray(faces, dtype=np.float32).reshape(-1, 5)
+    if len(faces) == 0:
+        return -1
+    if mode == "center" and frame_shape is not None:
+        h, w = frame_shape[:2]
+        cx = (faces[:, 0] + faces[:, 2]) / 2 - w / 2
+        cy = (faces[:, 1] + faces[:, 3]) / 2 - h / 2
+        return int(np.argmin(cx * cx + cy * cy))
+    if mode == "confidence":
+        return int(np.argmax(faces[:, 4]))
+    return int(np.argmax((faces[:, 2] - faces[:, 0]) * (faces[:, 3] - faces[:, 1])))
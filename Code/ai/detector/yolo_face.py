@@ -5,23 +5,37 @@ import torch
 import numpy as np
 from ultralytics import YOLO
 
+from detector.postprocess import filter_faces
+
 import os
 
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "yolov8n-face-lindevs.pt")
 
 class YOLOFace:
-    def __init__(self, model_path=MODEL_PATH, conf_threshold=0.5):
+    def __init__(self, model_path=MODEL_PATH, conf_threshold=0.5, min_size=0, max_faces=0):
         self.model = YOLO(model_path)
         self.conf_threshold = conf_threshold
+        self.min_size = min_size
+        self.max_faces = max_faces
         print(f"YOLOFace LOADED: {model_path}")
 
-    def detect(self, img_bgr):
-        results = self.model.predict(img_bgr, conf=self.conf_threshold, verbose=False)
-        boxes = []
-        for r in results:
-            for box in r.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].int().tolist()
-                conf = float(box.conf[0])
-                if conf > self.conf_threshold:
-                    boxes.append([x1, y1, x2, y2, conf])
-        return boxes
+    def _to_arrays(self, r):
+        """Kết quả 1 ảnh → (boxes N×5 float32 [x1, y1, x2, y2, conf], keypoints N×5×2 hoặc None)."""
+        # predict đã lọc conf → chỉ cần 1 lần chuyển tensor → NumPy cho cả ảnh
+        boxes = r.boxes.data[:, :5].cpu().numpy().astype(np.float32).reshape(-1, 5)
+        kpts = None
+        if getattr(r, "keypoints", None) is not None and len(r.keypoints):
+            kpts = r.keypoints.xy.cpu().numpy().astype(np.float32)
+        return filter_faces(boxes, kpts, self.min_size, self.max_faces)
+
+    def detect(self, img_bgr, landmarks=False):
+        """boxes N×5 (giảm dần theo conf); landmarks=True → (boxes, keypoints N×5×2 hoặc None)."""
+        return self.detect_batch([img_bgr], landmarks)[0]
+
+    def detect_batch(self, imgs_bgr, landmarks=False):
+        """Detect nhiều ảnh bằng 1 lần predict, trả về kết quả theo từng ảnh (như detect)."""
+        if not len(imgs_bgr):
+            return []
+        results = self.model.predict(list(imgs_bgr), conf=self.conf_threshold, verbose=False)
+        out = [self._to_arrays(r) for r in results]
+        return out if landmarks else [boxes for boxes, _ in out]
@@ -0,0 +1,141 @@
+# detector/yolo_face_onnx.py
+import os
+import cv2
+import numpy as np
+
+from detector.postprocess import filter_faces
+from utils.ort_session import create_session
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "yolov8n-face-lindevs.onnx")
+
+
+def letterbox(img, size=(640, 640), color=(114, 114, 114)):
+    """
+    Resize giữ tỉ lệ + pad về size (giống ultralytics LetterBox, auto=False).
+    Trả về (ảnh, tỉ lệ, (pad_x, pad_y)) để đổi box về ảnh gốc.
+    """
+    h, w = img.shape[:2]
+    r = min(size[0] / h, size[1] / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (size[1] - new_w) / 2, (size[0] - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, r, (left, top)
+
+
+def nms(boxes, scores, iou_threshold=0.7, max_det=None):
+    """
+    NMS NumPy: boxes (N, 4) xyxy đã sắp giảm dần theo score; trả về chỉ số được giữ.
+    Greedy như ultralytics: mỗi vòng giữ box điểm cao nhất, tính IoU 1 hàng với các box còn lại
+    → bộ nhớ O(N) thay vì ma trận N×N; dừng khi đủ max_det box.
+    """
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=np.int64)
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.arange(len(boxes))
+    keep = []
+    while order.size and (max_det is None or len(keep) < max_det):
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = iw * ih
+        order = rest[inter / (areas[i] + areas[rest] - inter + 1e-9) <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class YOLOFaceONNX:
+    """
+    YOLOv8-face chạy bằng ONNX Runtime (không cần torch/ultralytics lúc chạy).
+    Export 1 lần: python tools/export_yolo_onnx.py
+    Output model: (N, 4 + 1 [+ 5×3 keypoint], anchors) → letterbox, lọc conf, NMS bằng NumPy.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, conf_threshold=0.5, iou_threshold=0.7,
+                 imgsz=640, max_det=300, min_size=0, max_faces=0, ort_options=None):
+        self.session = create_session(model_path, ort_options)
+        self.conf_threshold = conf_threshold
+        self.min_size = min_size
+        self.max_faces = max_faces
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        h, w = model_input.shape[2:4]
+        # Model export với dynamic=True → kích thước lấy từ imgsz
+        self.imgsz = (h if isinstance(h, int) else imgsz, w if isinstance(w, int) else imgsz)
+        fixed = model_input.shape[0]
+        self.batch_size = fixed if isinstance(fixed, int) and fixed > 0 else None
+        print(f"YOLOFace (ONNX) LOADED: {model_path}")
+
+    def _preprocess(self, imgs_bgr):
+        blob = np.empty((len(imgs_bgr), 3) + self.imgsz, dtype=np.float32)
+        metas = []
+        for i, img in enumerate(imgs_bgr):
+            boxed, r, pad = letterbox(img, self.imgsz)
+            # BGR → RGB, HWC → CHW, /255
+            blob[i] = boxed[:, :, ::-1].transpose(2, 0, 1)
+            metas.append((r, pad, img.shape[:2]))
+        blob *= 1.0 / 255.0
+        return blob, metas
+
+    def _postprocess(self, pred, meta):
+        """pred (C, anchors) của 1 ảnh → (boxes N×5 [x1, y1, x2, y2, conf], keypoints N×5×2 hoặc None)."""
+        r, (pad_x, pad_y), (h, w) = meta
+        scores = pred[4]
+        mask = scores > self.conf_threshold
+        if not mask.any():
+            return np.empty((0, 5), dtype=np.float32), None
+        p = pred[:, mask].T
+        # Chỉ giữ max_det × 10 ứng viên điểm cao nhất trước NMS (conf thấp / ảnh đông người)
+        order = np.argsort(-p[:, 4])[:self.max_det * 10]
+        p = p[order]
+        cx, cy, bw, bh = p[:, 0], p[:, 1], p[:, 2], p[:, 3]
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        keep = nms(boxes, p[:, 4], self.iou_threshold, self.max_det)
+        boxes, p = boxes[keep], p[keep]
+
+        # Bỏ letterbox → tọa độ ảnh gốc
+        boxes -= (pad_x, pad_y, pad_x, pad_y)
+        boxes /= r
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        out = np.concatenate([boxes, p[:, 4:5]], axis=1).astype(np.float32)
+
+        kpts = None
+        if p.shape[1] >= 5 + 15:
+            kpts = p[:, 5:20].reshape(-1, 5, 3)[:, :, :2].copy()
+            kpts -= (pad_x, pad_y)
+            kpts /= r
+        return filter_faces(out, kpts, self.min_size, self.max_faces)
+
+    def _infer(self, imgs_bgr):
+        blob, metas = self._preprocess(imgs_bgr)
+        if self.batch_size is None:
+            preds = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            # Model batch cố định → chạy theo lô đúng kích thước (pad lô cuối)
+            preds = []
+            for s in range(0, len(blob), self.batch_size):
+                chunk = blob[s:s + self.batch_size]
+                n = len(chunk)
+                if n < self.batch_size:
+                    chunk = np.concatenate([chunk, np.zeros((self.batch_size - n,) + chunk.shape[1:], chunk.dtype)])
+                preds.append(self.session.run(None, {self.input_name: chunk})[0][:n])
+            preds = np.concatenate(preds)
+        return [self._postprocess(pred, meta) for pred, meta in zip(preds, metas)]
+
+    def detect(self, img_bgr, landmarks=False):
+        """boxes N×5 (giảm dần theo conf); landmarks=True → (boxes, keypoints N×5×2 hoặc None)."""
+        return self.detect_batch([img_bgr], landmarks)[0]
+
+    def detect_batch(self, imgs_bgr, landmarks=False):
+        """Detect nhiều ảnh bằng 1 lần session.run, trả về kết quả theo từng ảnh (như detect)."""
+        if not len(imgs_bgr):
+            return []
+        out = self._infer(imgs_bgr)
+        return out if landmarks else [boxes for boxes, _ in out]
@@ -1,41 +1,99 @@
 # embedder/arcface.py
 import cv2
 import numpy as np
-import onnxruntime as ort
 import os
-from utils.crop_face import crop_face_expanded
+import threading
+from utils.ort_session import ORT_DEFAULTS, create_session
 
 
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "w600k_r50.onnx")
 
 class ArcFace:
-    def __init__(self, model_path=MODEL_PATH):
-        self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    def __init__(self, model_path=MODEL_PATH, max_batch=32, ort_options=None):
+        ort_options = dict(ORT_DEFAULTS, **(ort_options or {}))
+        self.session = create_session(model_path, ort_options)
         self.input_size = (112, 112)
+        model_input = self.session.get_inputs()[0]
+        model_output = self.session.get_outputs()[0]
+        self.input_name = model_input.name
+        self.output_name = model_output.name
+        # Trục batch cố định (int) → chia lô theo đúng kích thước đó; động (str/None) → tối đa max_batch
+        fixed = model_input.shape[0]
+        self.dynamic_batch = not (isinstance(fixed, int) and fixed > 0)
+        self.batch_size = max_batch if self.dynamic_batch else fixed
+        dim = model_output.shape[-1]
+        self.embedding_size = dim if isinstance(dim, int) else 512
 
-    # embedder/arcface.py → CROP RỘNG HƠN
-    def _preprocess(self, face_bgr):
-        h, w = face_bgr.shape[:2]
-        # MỞ RỘNG 30% TRÊN + DƯỚI, 20% TRÁI + PHẢI
-        expand_h = int(h * 0.3)
-        expand_w = int(w * 0.2)
-        face_expanded = cv2.copyMakeBorder(
-            face_bgr, expand_h, expand_h, expand_w, expand_w,
-            cv2.BORDER_REPLICATE
-        )
-        face = cv2.resize(face_expanded, self.input_size)
-        face = face.astype(np.float32)
-        face = (face - 127.5) / 128.0
-        face = face.transpose(2, 0, 1)[np.newaxis, ...]
-        return face
+        # I/O binding: ORT ghi thẳng vào buffer output cấp sẵn (không cấp phát mỗi lần chạy)
+        self._lock = threading.Lock()
+        self._binding = self.session.io_binding() if ort_options["io_binding"] else None
+        self._output = np.empty((self.batch_size, self.embedding_size), dtype=np.float32)
+        # Buffer input dùng lại cho mọi lô (tiền xử lý ghi thẳng vào, không cấp phát mỗi request)
+        self._prep_lock = threading.Lock()
+        self._blob = np.empty((self.batch_size, 3) + self.input_size[::-1], dtype=np.float32)
+
+    def _preprocess_into(self, faces_bgr, out):
+        """
+        Ghi các ảnh 112x112 (BGR uint8) vào out (N, 3, 112, 112) float32 cấp sẵn:
+        HWC → CHW và (x - 127.5) / 128 làm tại chỗ, không tạo mảng trung gian.
+        """
+        for face, dst in zip(faces_bgr, out):
+            # Ảnh vào đã là 112x112 từ utils.align.align_face; kích thước khác thì resize
+            if face.shape[1::-1] != self.input_size:
+                face = cv2.resize(face, self.input_size)
+            np.subtract(face.transpose(2, 0, 1), 127.5, out=dst, dtype=np.float32)
+        out *= 1.0 / 128.0
+        return out
 
     def get(self, face_bgr):
-    # DÙNG CROP RỘNG
-        face_crop, _ = crop_face_expanded(face_bgr, 0, 0, face_bgr.shape[1], face_bgr.shape[0])
-        input_blob = self._preprocess(face_bgr)
-        input_name = self.session.get_inputs()[0].name
-        embedding = self.session.run(None, {input_name: input_blob})[0]
-        embedding = embedding.flatten()
+        return self.get_batch([face_bgr])[0]
+
+    def get_batch(self, faces_bgr):
+        """Embedding cho nhiều crop (mỗi lô tối đa batch_size ảnh, tiền xử lý vào buffer dùng lại)."""
+        if len(faces_bgr) == 0:
+            return np.empty((0, self.embedding_size), dtype=np.float32)
+        outputs = []
+        with self._prep_lock:
+            for start in range(0, len(faces_bgr), self.batch_size):
+                chunk = faces_bgr[start:start + self.batch_size]
+                n = len(chunk)
+                blob = self._preprocess_into(chunk, self._blob[:n])
+                if not self.dynamic_batch and n < self.batch_size:
+                    # Model batch cố định: pad bằng 0 cho đủ lô rồi bỏ phần thừa
+                    self._blob[n:self.batch_size] = 0
+                    out = self._run(self._blob[:self.batch_size])[:n]
+                else:
+                    out = self._run(blob)
+                outputs.append(out.reshape(n, -1))
+        embeddings = np.concatenate(outputs)
         # L2 normalize
-        embedding = embedding / np.linalg.norm(embedding)
-        return embedding
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def _run_bound(self, blob):
+        """session.run qua I/O binding: input dùng thẳng bộ nhớ của blob, output ghi vào buffer cấp sẵn."""
+        blob = np.ascontiguousarray(blob, dtype=np.float32)
+        with self._lock:
+            out = self._output[:len(blob)]
+            self._binding.bind_input(self.input_name, "cpu", 0, np.float32, blob.shape, blob.ctypes.data)
+            self._binding.bind_output(self.output_name, "cpu", 0, np.float32, out.shape, out.ctypes.data)
+            self.session.run_with_iobinding(self._binding)
+            return out.copy()
+
+    def _run(self, blob):
+        if self._binding is not None and len(blob) <= len(self._output):
+            try:
+                return self._run_bound(blob)
+            except Exception as e:
+                # Output không có dạng (N, dim) hoặc ORT cũ → quay về session.run
+                print(f"[ArcFace] I/O binding lỗi ({e}), dùng session.run")
+                self._binding = None
+        try:
+            return self.session.run(None, {self.input_name: blob})[0]
+        except Exception:
+            if len(blob) == 1:
+                raise
+            # Model không nhận batch > 1 → chạy từng ảnh và ghi nhớ cho lần sau
+            print(f"[ArcFace] batch {len(blob)} lỗi, chuyển sang batch_size=1")
+            self.batch_size = 1
+            return np.concatenate([self.session.run(None, {self.input_name: b[np.newaxis]})[0] for b in blob])
@@ -0,0 +1,116 @@
+# gallery/ann.py
+import os
+import threading
+import numpy as np
+
+
+def _kmeans(x, nlist, iters=10, sample=65536, seed=0):
+    """K-means cầu (cosine) trên tập mẫu; trả về centroid đã chuẩn hóa."""
+    rng = np.random.default_rng(seed)
+    if len(x) > sample:
+        x = x[rng.choice(len(x), sample, replace=False)]
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        bounds = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums[filled] = np.add.reduceat(x[order], bounds[filled])
+        empty = ~filled
+        # Cụm rỗng → lấy ngẫu nhiên 1 điểm làm tâm mới
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-8)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted-file index (IVF-Flat) viết bằng NumPy cho gallery lớn.
+    - train   : k-means chia embedding thành nlist cụm
+    - add     : gán hàng mới vào cụm gần nhất (tăng dần, không train lại)
+    - search  : chỉ tính cosine với hàng trong nprobe cụm gần probe nhất
+    nprobe càng lớn → recall càng cao nhưng chậm hơn; nprobe = nlist tương đương tìm chính xác.
+    Hàng được lưu bằng chỉ số trong ma trận gallery, index không giữ bản sao embedding.
+    """
+
+    def __init__(self, centroids, assign=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = len(self.centroids)
+        self._lock = threading.Lock()
+        self._lists = [np.empty((0,), dtype=np.int64) for _ in range(self.nlist)]
+        self.assign = np.empty((0,), dtype=np.int32)
+        if assign is not None and len(assign):
+            self._set_assign(np.asarray(assign, dtype=np.int32))
+
+    @property
+    def rows(self):
+        """Số hàng (0..rows-1) đã được gán cụm."""
+        return len(self.assign)
+
+    @classmethod
+    def train(cls, matrix, nlist=0, iters=10):
+        nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+        nlist = min(nlist, len(matrix))
+        index = cls(_kmeans(matrix, nlist, iters))
+        index.add(matrix, 0)
+        return index
+
+    def _set_assign(self, assign):
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(self.nlist)]
+        self.assign = assign
+
+    def add(self, rows, start):
+        """Gán các hàng matrix[start:start+len(rows)] vào cụm (chỉ thêm hàng chưa có)."""
+        with self._lock:
+            skip = self.rows - start
+            if skip >= len(rows):
+                return
+            if skip > 0:
+                rows, start = rows[skip:], start + skip
+            assign = np.argmax(np.asarray(rows, dtype=np.float32) @ self.centroids.T, axis=1).astype(np.int32)
+            ids = np.arange(start, start + len(rows), dtype=np.int64)
+            lists = list(self._lists)
+            for c in np.unique(assign):
+                lists[c] = np.concatenate((lists[c], ids[assign == c]))
+            # Thay cả danh sách 1 lần → thread đang search vẫn thấy trạng thái nhất quán
+            self._lists = lists
+            self.assign = np.concatenate((self.assign, assign))
+
+    def search(self, q, matrix, nprobe=8, limit=None):
+        """Trả về (row_ids, sims) của các hàng ứng viên (chỉ số < limit)."""
+        nprobe = min(nprobe, self.nlist)
+        centroid_sims = self.centroids @ q
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+        lists = self._lists
+        cand = np.concatenate([lists[c] for c in probe])
+        if limit is not None:
+            cand = cand[cand < limit]
+        if len(cand) == 0:
+            return cand, np.empty((0,), dtype=np.float32)
+        cand.sort()  # truy cập ma trận (memmap) theo thứ tự tăng dần
+        return cand, matrix[cand] @ q
+
+    # ====== LƯU / NẠP ======
+    def save(self, path, generation):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, assign=self.assign, generation=generation)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, generation):
+        """Nạp index đã lưu; None nếu không có hoặc thuộc generation khác (đã compact)."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["generation"]) != generation:
+                    return None
+                return cls(data["centroids"], data["assign"])
+        except (OSError, ValueError, KeyError):
+            return None
@@ -0,0 +1,529 @@
+# gallery/face_gallery.py
+import os
+import pickle
+import threading
+import numpy as np
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery.ann import IVFIndex
+from gallery.storage import GalleryStorage
+from gallery.quantize import QUANT_DEFAULTS, PRECISIONS, CompactMatrix
+from gallery.templates import TEMPLATE_DEFAULTS, build_templates
+
+DATA_DIR = "data/users"        # định dạng cũ: 1 file .pkl / user
+GALLERY_DIR = "data/gallery"   # định dạng mới: ma trận float32 + index.json
+EMBEDDING_KEYS = ("embeddings", "mean_embedding", "embedding")
+ANN_DEFAULTS = {
+    "enabled": True,
+    "min_rows": 20000,   # ít hơn → tìm chính xác (brute-force)
+    "nlist": 0,          # 0 = tự chọn ~ sqrt(rows)
+    "nprobe": 16,
+    "retrain_growth": 4, # rows tăng gấp N lần so với lúc train → train lại khi nạp
+    "save_every": 1000,  # lưu ivf.npz sau mỗi N hàng thêm mới
+}
+
+
+def load_users(data_dir):
+    users = []
+    if not os.path.exists(data_dir):
+        return users
+    for file in os.listdir(data_dir):
+        if file.endswith(".pkl"):
+            path = os.path.join(data_dir, file)
+            try:
+                with open(path, "rb") as f:
+                    user = pickle.load(f)
+                    users.append(user)
+                    print(f"LOADED USER: {user.get('name', 'N/A')} - {user.get('acc', 'N/A')}")
+            except Exception as e:
+                print(f"LOAD USER ERROR {path}: {e}")
+    return users
+
+
+def get_user_embeddings(user):
+    """Lấy tất cả embedding từ user, bất kể cấu trúc."""
+    embs = []
+    if "embeddings" in user and isinstance(user["embeddings"], list):
+        embs.extend(user["embeddings"])
+    if "mean_embedding" in user:
+        embs.append(user["mean_embedding"])
+    if "embedding" in user:
+        embs.append(user["embedding"])
+    return [np.asarray(e, dtype=np.float32).ravel() for e in embs if e is not None]
+
+
+def user_meta(user):
+    """Thông tin user lưu trong index (bỏ các trường embedding)."""
+    return {k: v for k, v in user.items() if k not in EMBEDDING_KEYS}
+
+
+def l2_normalize(x):
+    """Chuẩn hóa L2 theo hàng (float32)."""
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / (norm + 1e-8)
+
+
+def get_user_shots(user):
+    """Các shot đăng ký gốc (không gồm mean_embedding); user cũ chỉ có 1 embedding thì lấy embedding đó."""
+    if isinstance(user.get("embeddings"), list) and user["embeddings"]:
+        return [np.asarray(e, dtype=np.float32).ravel() for e in user["embeddings"]]
+    return get_user_embeddings(user)
+
+
+def prepare_user(user, templates=None):
+    """
+    Trả về (meta, rows, shots):
+    - rows  : hàng đưa vào ma trận so khớp (≤ k template nếu bật templates, ngược lại mọi embedding)
+    - shots : shot gốc đã chuẩn hóa, lưu riêng để tính lại template
+    """
+    templates = dict(TEMPLATE_DEFAULTS, **(templates or {}))
+    embs = get_user_shots(user)
+    if not embs:
+        raise ValueError(f"User {user.get('acc')} không có embedding")
+    shots = l2_normalize(np.stack(embs))
+    meta = user_meta(user)
+    if templates["enabled"]:
+        rows, keep = build_templates(shots, **templates)
+        meta["num_templates"] = len(rows)
+        meta["num_shots"] = len(shots)
+        meta["rejected_shots"] = int((~keep).sum())
+    else:
+        for key in ("num_templates", "num_shots", "rejected_shots"):
+            meta.pop(key, None)
+        rows = l2_normalize(np.stack(get_user_embeddings(user)))
+    return meta, rows, shots
+
+
+def migrate_pickles(data_dir=DATA_DIR, gallery_dir=GALLERY_DIR, dim=512, templates=None):
+    """Chuyển toàn bộ data/users/*.pkl sang gallery dạng cột (bỏ qua acc đã có)."""
+    storage = GalleryStorage(gallery_dir, dim)
+    existing = {u["acc"] for u in storage.load()[1]}
+    entries = []
+    for user in load_users(data_dir):
+        if user.get("acc") in existing or not get_user_embeddings(user):
+            continue
+        existing.add(user["acc"])
+        meta, rows, shots = prepare_user(user, templates)
+        storage.save_shots(meta["acc"], shots)
+        entries.append((meta, rows))
+    if entries:
+        storage.append(entries)
+    return len(entries)
+
+
+class _Snapshot:
+    """Trạng thái bất biến của gallery; verify đọc snapshot nên không cần khóa."""
+
+    __slots__ = ("users", "buffer", "size", "starts", "live", "ann", "compact", "_seg_user", "_acc_index")
+
+    def __init__(self, users, buffer, size, starts, live, ann=None, compact=None):
+        self.users = users
+        self.buffer = buffer
+        self.size = size
+        self.starts = starts
+        self.live = live
+        self.ann = ann
+        self.compact = compact
+        self._seg_user = None
+        self._acc_index = None
+
+    @property
+    def matrix(self):
+        return self.buffer[:self.size]
+
+    @property
+    def search_matrix(self):
+        """Ma trận dùng cho lượt so khớp thô: bản nén nếu có, ngược lại float32."""
+        return self.compact if self.compact is not None else self.buffer
+
+    @property
+    def acc_index(self):
+        """acc → chỉ số trong users."""
+        if self._acc_index is None:
+            self._acc_index = {u.get("acc"): i for i, u in enumerate(self.users)}
+        return self._acc_index
+
+    @property
+    def seg_user(self):
+        """Chỉ số user của từng đoạn (chỉ có nghĩa với đoạn còn sống)."""
+        if self._seg_user is None:
+            self._seg_user = np.cumsum(self.live) - 1
+        return self._seg_user
+
+
+class FaceGallery:
+    """
+    Toàn bộ embedding đã đăng ký trong 1 ma trận float32 liền bộ nhớ (đã chuẩn hóa L2).
+    - matrix         : các hàng embedding, mỗi user 1 đoạn liên tiếp
+    - starts[i]      : hàng bắt đầu của đoạn i → lấy max theo đoạn bằng reduceat
+    - live[i]        : False nếu đoạn i thuộc user đã xóa (bỏ qua khi so khớp)
+    Thứ tự các đoạn còn sống trùng thứ tự self.users.
+
+    Nếu có storage, ma trận lúc khởi động là memmap của file gallery; thêm user
+    ghi nối vào storage rồi vào buffer RAM (dung lượng tăng gấp đôi khi đầy),
+    xóa user chỉ đánh dấu đoạn chết → an toàn khi nhiều thread cùng đọc.
+
+    Khi số hàng ≥ ann["min_rows"], so khớp dùng IVFIndex (chỉ xét nprobe cụm gần
+    nhất) thay cho nhân toàn bộ ma trận; gallery nhỏ vẫn tìm chính xác.
+
+    Nếu bật templates, mỗi user chỉ đóng góp ≤ k template (gom từ các shot đăng ký,
+    đã loại shot xấu); shot gốc lưu riêng trong data/gallery/shots/ để tính lại.
+
+    Nếu quantization["precision"] là float16/int8, RAM chỉ giữ bản nén (CompactMatrix)
+    để lọc thô; float32 gốc nằm trên đĩa (memmap) và chỉ được đọc để tính lại điểm
+    chính xác cho quantization["rerank"] user ứng viên.
+    """
+
+    def __init__(self, dim=512, storage=None, ann=None, templates=None, quantization=None):
+        self.dim = dim
+        self.storage = storage
+        self.ann = dict(ANN_DEFAULTS, **(ann or {}))
+        self.templates = dict(TEMPLATE_DEFAULTS, **(templates or {}))
+        self.quantization = dict(QUANT_DEFAULTS, **(quantization or {}))
+        if self.quantization["precision"] not in PRECISIONS:
+            raise ValueError(f"precision không hỗ trợ: {self.quantization['precision']}")
+        self.version = 0
+        self._ann_saved_rows = 0
+        self._lock = threading.RLock()
+        self._snap = _Snapshot([], np.empty((0, dim), dtype=np.float32), 0,
+                               np.empty((0,), dtype=np.int64), np.empty((0,), dtype=bool),
+                               compact=self._build_compact(np.empty((0, dim), dtype=np.float32)))
+
+    @classmethod
+    def from_users(cls, users, dim=512, ann=None, templates=None, quantization=None):
+        """Gallery chỉ trong RAM (không ghi đĩa), dùng cho test/benchmark."""
+        gallery = cls(dim, ann=ann, templates=templates, quantization=quantization)
+        for user in users:
+            if get_user_embeddings(user):
+                meta, rows, _ = prepare_user(user, gallery.templates)
+                gallery._append(meta, rows)
+        return gallery
+
+    @classmethod
+    def from_matrix(cls, users, matrix, counts, dim=512, ann=None, quantization=None):
+        """Gallery trong RAM dựng 1 lần từ ma trận có sẵn (users[i] sở hữu counts[i] hàng liên tiếp)."""
+        gallery = cls(dim, ann=ann, templates={"enabled": False}, quantization=quantization)
+        matrix = l2_normalize(matrix)
+        counts = np.asarray(counts, dtype=np.int64)
+        gallery._set(list(users), matrix, np.cumsum(counts) - counts, np.ones(len(counts), dtype=bool))
+        return gallery
+
+    @classmethod
+    def open(cls, gallery_dir=GALLERY_DIR, dim=512, legacy_dir=DATA_DIR, ann=None, templates=None,
+             quantization=None):
+        """Mở gallery trên đĩa; lần đầu tự chuyển các file .pkl cũ nếu có."""
+        storage = GalleryStorage(gallery_dir, dim)
+        if not storage.exists() and legacy_dir and os.path.isdir(legacy_dir):
+            migrated = migrate_pickles(legacy_dir, gallery_dir, dim, templates)
+            if migrated:
+                print(f"[GALLERY] Đã chuyển {migrated} user từ {legacy_dir} sang {gallery_dir}")
+        gallery = cls(dim, storage, ann, templates, quantization)
+        gallery.reload()
+        return gallery
+
+    @classmethod
+    def from_config(cls, gallery_dir=GALLERY_DIR):
+        """Mở gallery với các tham số ann/templates/quantization trong config.yaml."""
+        from utils import config
+        return cls.open(gallery_dir, ann=config.get("gallery", "ann"),
+                        templates=config.get("gallery", "templates"),
+                        quantization=config.get("gallery", "quantization"))
+
+    # ====== BUILD ======
+    def _build_compact(self, matrix):
+        precision = self.quantization["precision"]
+        return None if precision == "float32" else CompactMatrix.build(matrix, precision)
+
+    def _append(self, meta, rows):
+        snap = self._snap
+        size = snap.size + len(rows)
+        buffer = snap.buffer
+        compact = snap.compact.append(rows) if snap.compact is not None else None
+        if compact is not None and self.storage is not None:
+            # Hàng mới đã nằm trong file gallery → chỉ mở lại memmap, không chép float32 vào RAM
+            buffer = self.storage.open_matrix(size)
+        else:
+            if size > len(buffer) or isinstance(buffer, np.memmap):
+                buffer = np.empty((max(size, 2 * len(buffer), 64), self.dim), dtype=np.float32)
+                buffer[:snap.size] = snap.matrix
+            buffer[snap.size:size] = rows
+        ann = snap.ann
+        if ann is not None:
+            ann.add(rows, snap.size)
+        elif self._ann_wanted(size):
+            ann = self._train_ann(buffer[:size])
+        self._snap = _Snapshot(snap.users + [meta], buffer, size,
+                               np.append(snap.starts, snap.size), np.append(snap.live, True),
+                               ann, compact)
+        self._maybe_save_ann(ann)
+
+    def _find(self, acc):
+        return self._snap.acc_index.get(acc, -1)
+
+    def _drop(self, idx):
+        snap = self._snap
+        live = snap.live.copy()
+        live[np.flatnonzero(live)[idx]] = False
+        self._snap = _Snapshot(snap.users[:idx] + snap.users[idx + 1:], snap.buffer,
+                               snap.size, snap.starts, live, snap.ann, snap.compact)
+
+    # ====== ANN ======
+    def _ann_wanted(self, rows):
+        return bool(self.ann["enabled"]) and rows >= self.ann["min_rows"]
+
+    def _train_ann(self, matrix):
+        ann = IVFIndex.train(matrix, self.ann["nlist"])
+        print(f"[GALLERY] Train IVF: {len(matrix)} hàng, {ann.nlist} cụm")
+        self._save_ann(ann)
+        return ann
+
+    def _save_ann(self, ann):
+        if self.storage is not None:
+            ann.save(self.storage.ann_path, self.storage.generation)
+            self._ann_saved_rows = ann.rows
+
+    def _maybe_save_ann(self, ann):
+        if ann is not None and ann.rows - self._ann_saved_rows >= self.ann["save_every"]:
+            self._save_ann(ann)
+
+    def _load_ann(self, matrix):
+        """Nạp ivf.npz (bổ sung hàng còn thiếu), train lại nếu chưa có hoặc gallery đã lớn hơn nhiều."""
+        if not self._ann_wanted(len(matrix)):
+            return None
+        ann = IVFIndex.load(self.storage.ann_path, self.storage.generation)
+        if ann is None or ann.rows * self.ann["retrain_growth"] < len(matrix):
+            return self._train_ann(matrix)
+        self._ann_saved_rows = ann.rows
+        ann.add(matrix[ann.rows:], ann.rows)
+        self._maybe_save_ann(ann)
+        return ann
+
+    # ====== CẬP NHẬT ======
+    def add_user(self, user):
+        """Thêm 1 user mới: ghi nối vào storage rồi vào RAM (không nạp lại toàn bộ)."""
+        meta, rows, shots = prepare_user(user, self.templates)
+        with self._lock:
+            if self._find(meta.get("acc")) >= 0:
+                raise KeyError(f"Mã acc {meta.get('acc')} đã tồn tại")
+            if self.storage is None:
+                self._append(meta, rows)
+                self.version += 1
+                return
+            prev, new = self.storage.append([(meta, rows)])
+            self.storage.save_shots(meta["acc"], shots)
+            if prev != self.version:
+                self.reload()  # worker khác cũng vừa ghi → nạp lại cho đồng bộ
+            else:
+                self._append(meta, rows)
+                self.version = new
+
+    def replace_user(self, user):
+        """Thay toàn bộ embedding của user đã có."""
+        meta, rows, shots = prepare_user(user, self.templates)
+        with self._lock:
+            idx = self._find(meta.get("acc"))
+            if idx < 0:
+                raise KeyError(f"Không tìm thấy acc {meta.get('acc')}")
+            compacted, prev = False, self.version
+            if self.storage is not None:
+                prev, new, compacted = self.storage.replace(meta, rows)
+                self.storage.save_shots(meta["acc"], shots)
+            if compacted or prev != self.version:
+                self.reload()
+                return
+            self._drop(idx)
+            self._append(meta, rows)
+            self.version = new if self.storage is not None else self.version + 1
+
+    def remove_user(self, acc):
+        with self._lock:
+            idx = self._find(acc)
+            if idx < 0:
+                return False
+            compacted, prev = False, self.version
+            found = True
+            if self.storage is not None:
+                found, prev, new, compacted = self.storage.remove(acc)
+                self.storage.delete_shots(acc)
+            if not found or compacted or prev != self.version:
+                self.reload()
+                return True
+            self._drop(idx)
+            self.version = new if self.storage is not None else self.version + 1
+            return True
+
+    def rebuild_templates(self):
+        """Tính lại template của mọi user từ shot gốc (user chưa có shot thì dùng hàng hiện tại)."""
+        count = 0
+        for meta in list(self.users):
+            acc = meta["acc"]
+            shots = self.storage.load_shots(acc) if self.storage is not None else None
+            if shots is None:
+                shots = self.get_rows(acc)
+            self.replace_user(dict(meta, embeddings=list(shots)))
+            count += 1
+        return count
+
+    # ====== ĐỒNG BỘ GIỮA CÁC WORKER ======
+    def is_stale(self):
+        """True nếu worker khác đã đổi gallery trên đĩa."""
+        return self.storage is not None and self.storage.read_version() != self.version
+
+    def reload(self):
+        with self._lock:
+            version, users, matrix, starts, live = self.storage.load()
+            self._set(users, matrix, starts, live)
+            self.version = version
+
+    def _set(self, users, matrix, starts, live):
+        ann = self._load_ann(matrix) if self.storage is not None else (
+            self._train_ann(matrix) if self._ann_wanted(len(matrix)) else None)
+        self._snap = _Snapshot(users, matrix, len(matrix), starts, live, ann, self._build_compact(matrix))
+
+    def refresh_if_stale(self):
+        """
+        Nạp lại nếu worker khác đã đổi gallery. reload() là O(N) (memmap, IVF, bản nén) →
+        API gọi qua thread pool, không chạy trên event loop; request đang match vẫn dùng snapshot cũ.
+        """
+        if not self.is_stale():
+            return
+        with self._lock:
+            # Nhiều request cùng thấy stale → chỉ request đầu nạp lại
+            if self.is_stale():
+                print(f"[GALLERY] Phát hiện thay đổi (version {self.version} → {self.storage.read_version()}), nạp lại")
+                self.reload()
+
+    # ====== TRUY VẤN ======
+    def __len__(self):
+        return len(self._snap.users)
+
+    def __contains__(self, acc):
+        return self._find(acc) >= 0
+
+    @property
+    def users(self):
+        return self._snap.users
+
+    @property
+    def matrix(self):
+        return self._snap.matrix
+
+    @property
+    def owners(self):
+        """Chỉ số user (trong self.users) của từng hàng; -1 với hàng đã xóa."""
+        snap = self._snap
+        counts = np.diff(np.append(snap.starts, snap.size))
+        seg_owner = np.full(len(snap.starts), -1, dtype=np.int32)
+        seg_owner[snap.live] = np.arange(len(snap.users), dtype=np.int32)
+        return np.repeat(seg_owner, counts)
+
+    def get_rows(self, acc):
+        """Bản sao các hàng so khớp của 1 user (None nếu không có)."""
+        snap = self._snap
+        idx = self._find(acc)
+        if idx < 0:
+            return None
+        seg = np.flatnonzero(snap.live)[idx]
+        end = snap.starts[seg + 1] if seg + 1 < len(snap.starts) else snap.size
+        return np.array(snap.matrix[snap.starts[seg]:end])
+
+    @property
+    def num_embeddings(self):
+        snap = self._snap
+        counts = np.diff(np.append(snap.starts, snap.size))
+        return int(counts[snap.live].sum())
+
+    @property
+    def memory(self):
+        """Số byte RAM của dữ liệu so khớp (bản nén nếu có, ngược lại float32)."""
+        snap = self._snap
+        if snap.compact is not None:
+            return snap.compact.nbytes
+        return snap.size * self.dim * 4
+
+    def _user_scores(self, snap, emb):
+        q = l2_normalize(emb).ravel()
+        sims = snap.compact.dot(q) if snap.compact is not None else snap.matrix @ q
+        return np.maximum.reduceat(sims, snap.starts)[snap.live]
+
+    def user_scores(self, emb):
+        """Điểm cosine cao nhất của từng user với 1 embedding (xấp xỉ nếu gallery lưu dạng nén)."""
+        return self._user_scores(self._snap, emb)
+
+    def _ann_user_scores(self, snap, emb):
+        """Như _user_scores nhưng chỉ xét hàng ứng viên từ IVF; user không nằm trong ứng viên = -inf."""
+        q = l2_normalize(emb).ravel()
+        rows, sims = snap.ann.search(q, snap.search_matrix, self.ann["nprobe"], limit=snap.size)
+        seg = np.searchsorted(snap.starts, rows, side="right") - 1
+        alive = snap.live[seg]
+        scores = np.full(len(snap.users), -np.inf, dtype=np.float32)
+        np.maximum.at(scores, snap.seg_user[seg[alive]], sims[alive])
+        return scores
+
+    def match(self, emb, top_k=1, accs=None):
+        """
+        Trả về [(user, score)] của top_k user giống nhất, giảm dần theo score.
+        accs: chỉ so với các user này (1:1 hoặc allow-list của tủ) → chỉ đọc hàng của họ;
+        acc không tồn tại bị bỏ qua.
+        """
+        snap = self._snap
+        if not snap.users:
+            return []
+        if accs is not None:
+            idx = np.array(sorted({snap.acc_index[a] for a in accs if a in snap.acc_index}), dtype=np.int64)
+            if len(idx) == 0:
+                return []
+            scores = self._exact_user_scores(snap, emb, idx)
+            order = _top(scores, min(top_k, len(idx)))
+            return [(snap.users[idx[i]], float(scores[i])) for i in order]
+        if snap.ann is not None:
+            scores = self._ann_user_scores(snap, emb)
+        else:
+            scores = self._user_scores(snap, emb)
+        found = int(np.isfinite(scores).sum())
+        k = min(top_k, found)
+        if k == 0:
+            return []
+        if snap.compact is not None:
+            # Lọc thô trên bản nén → tính lại điểm float32 cho vài user đứng đầu
+            cand = _top(scores, min(max(k, self.quantization["rerank"]), found))
+            exact = self._exact_user_scores(snap, emb, cand)
+            order = np.argsort(-exact)[:k]
+            return [(snap.users[cand[i]], float(exact[i])) for i in order]
+        idx = _top(scores, k)
+        return [(snap.users[i], float(scores[i])) for i in idx]
+
+    def _exact_user_scores(self, snap, emb, idx):
+        """Điểm cosine float32 (đọc ma trận gốc) của các user idx."""
+        q = l2_normalize(emb).ravel()
+        segs = np.flatnonzero(snap.live)[idx]
+        ends = np.append(snap.starts, snap.size)
+        lo, counts = snap.starts[segs], ends[segs + 1] - snap.starts[segs]
+        offsets = np.cumsum(counts) - counts
+        rows = np.repeat(lo - offsets, counts) + np.arange(counts.sum())
+        sims = snap.matrix[rows] @ q
+        return np.maximum.reduceat(sims, offsets)
+
+
+def _top(scores, k):
+    """Chỉ số k phần tử lớn nhất, giảm dần."""
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx])]
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_gallery(gallery_dir=GALLERY_DIR):
+    """Gallery dùng chung trong process (register ghi, verify đọc)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FaceGallery.from_config(gallery_dir)
+        return _shared
@@ -0,0 +1,105 @@
+# gallery/quantize.py
+import numpy as np
+
+QUANT_DEFAULTS = {
+    "precision": "float32",  # float32 | float16 | int8 (bản nén giữ trong RAM để lọc thô)
+    "rerank": 32,            # số user ứng viên tính lại bằng float32 gốc
+}
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+def quantize(rows, precision):
+    """
+    Nén các hàng float32:
+    - float16 : trả về (codes float16, None)
+    - int8    : trả về (codes int8, scale float32 / hàng) với hàng ≈ codes * scale
+    """
+    rows = np.asarray(rows, dtype=np.float32)
+    if precision == "float16":
+        return rows.astype(np.float16), None
+    if precision == "int8":
+        scale = np.abs(rows).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        codes = np.clip(np.rint(rows / scale[:, None]), -127, 127).astype(np.int8)
+        return codes, scale.astype(np.float32)
+    raise ValueError(f"precision không hỗ trợ: {precision} (chọn {', '.join(PRECISIONS)})")
+
+
+class CompactMatrix:
+    """
+    Bản nén của ma trận gallery (float16: 1/2, int8: ~1/4 dung lượng float32).
+    - dot(q)     : cosine xấp xỉ với mọi hàng, giải nén theo khối nên bộ nhớ tạm nhỏ
+    - m[rows]    : giải nén vài hàng (dùng cho IVFIndex.search)
+    Chỉ ghi nối: append trả về đối tượng mới dùng chung buffer (dung lượng tăng gấp đôi khi đầy),
+    thread đang đọc bản cũ không bị ảnh hưởng.
+    """
+
+    CHUNK = 1024         # khối nhỏ nằm gọn trong cache khi giải nén
+    BUILD_CHUNK = 32768
+
+    def __init__(self, precision, dim, codes=None, scales=None, size=0):
+        self.precision = precision
+        self.dim = dim
+        dtype = np.int8 if precision == "int8" else np.float16
+        self.codes = codes if codes is not None else np.empty((0, dim), dtype=dtype)
+        self.scales = scales if scales is not None or precision != "int8" else np.empty((0,), dtype=np.float32)
+        self.size = size
+
+    @classmethod
+    def build(cls, matrix, precision):
+        """Nén ma trận float32 (có thể là memmap) theo khối."""
+        compact = cls(precision, matrix.shape[1])
+        codes = np.empty((len(matrix), matrix.shape[1]), dtype=compact.codes.dtype)
+        scales = np.empty((len(matrix),), dtype=np.float32) if precision == "int8" else None
+        for s in range(0, len(matrix), cls.BUILD_CHUNK):
+            c, sc = quantize(matrix[s:s + cls.BUILD_CHUNK], precision)
+            codes[s:s + len(c)] = c
+            if scales is not None:
+                scales[s:s + len(c)] = sc
+        return cls(precision, matrix.shape[1], codes, scales, len(matrix))
+
+    def append(self, rows):
+        codes, scales = self.codes, self.scales
+        size = self.size + len(rows)
+        if size > len(codes):
+            capacity = max(size, 2 * len(codes), 64)
+            codes = np.empty((capacity, self.dim), dtype=self.codes.dtype)
+            codes[:self.size] = self.codes[:self.size]
+            if scales is not None:
+                scales = np.empty((capacity,), dtype=np.float32)
+                scales[:self.size] = self.scales[:self.size]
+        c, sc = quantize(rows, self.precision)
+        codes[self.size:size] = c
+        if scales is not None:
+            scales[self.size:size] = sc
+        return CompactMatrix(self.precision, self.dim, codes, scales, size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, rows):
+        out = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            out *= self.scales[rows][:, None]
+        return out
+
+    def dot(self, q):
+        """Cosine xấp xỉ của q (float32, đã chuẩn hóa) với size hàng đầu."""
+        q = np.asarray(q, dtype=np.float32)
+        out = np.empty((self.size,), dtype=np.float32)
+        buf = np.empty((self.CHUNK, self.dim), dtype=np.float32)
+        for s in range(0, self.size, self.CHUNK):
+            e = min(s + self.CHUNK, self.size)
+            block = buf[:e - s]
+            block[...] = self.codes[s:e]
+            np.dot(block, q, out=out[s:e])
+        if self.scales is not None:
+            out *= self.scales[:self.size]
+        return out
+
+    @property
+    def nbytes(self):
+        """Số byte RAM thực dùng cho size hàng."""
+        per_row = self.codes.itemsize * self.dim + (4 if self.scales is not None else 0)
+        return self.size * per_row
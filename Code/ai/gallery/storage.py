@@ -0,0 +1,260 @@
+# gallery/storage.py
+import json
+import os
+import time
+import numpy as np
+
+INDEX_FILE = "index.json"
+VERSION_FILE = "VERSION"
+LOCK_FILE = ".lock"
+
+
+def read_version(gallery_dir):
+    """Đọc version gallery trên đĩa (0 nếu chưa có)."""
+    try:
+        with open(os.path.join(gallery_dir, VERSION_FILE), "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _FileLock:
+    """Khóa liên process đơn giản bằng file tạo độc quyền (chạy được cả Windows lẫn Linux)."""
+
+    def __init__(self, path, timeout=10.0, stale_after=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                        os.remove(self.path)  # process giữ khóa đã chết
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Không lấy được khóa {self.path}")
+                time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class GalleryStorage:
+    """
+    Gallery dạng cột trong 1 thư mục:
+    - embeddings.<gen>.f32 : ma trận float32 (rows × dim) đã chuẩn hóa, chỉ ghi nối
+    - index.json           : số hàng đã commit + danh sách user (acc, name, start, count, metadata)
+    - VERSION              : số version nhỏ để worker kiểm tra nhanh gallery đã đổi chưa
+
+    Ghi nối: ghi hàng mới vào cuối file .f32 (fsync) rồi thay index.json bằng os.replace.
+    Hàng nằm ngoài index (do crash giữa chừng) bị bỏ qua và ghi đè ở lần sau.
+    Xóa user chỉ bỏ khỏi index; khi hàng chết vượt quá nửa file thì compact sang generation mới.
+    """
+
+    def __init__(self, gallery_dir, dim=512):
+        self.dir = gallery_dir
+        self.dim = dim
+        self.generation = 0
+        os.makedirs(gallery_dir, exist_ok=True)
+        self._lock_path = os.path.join(gallery_dir, LOCK_FILE)
+
+    # ====== ĐỌC ======
+    def exists(self):
+        return os.path.exists(os.path.join(self.dir, INDEX_FILE))
+
+    def read_version(self):
+        return read_version(self.dir)
+
+    def _read_index(self):
+        path = os.path.join(self.dir, INDEX_FILE)
+        if not os.path.exists(path):
+            return {"dim": self.dim, "rows": 0, "generation": 0, "version": 0, "users": []}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _data_path(self, generation):
+        return os.path.join(self.dir, f"embeddings.{generation}.f32")
+
+    # ====== SHOT GỐC (chỉ dùng để tính lại template) ======
+    def _shots_path(self, acc):
+        return os.path.join(self.dir, "shots", f"{acc}.npy")
+
+    def save_shots(self, acc, shots):
+        path = self._shots_path(acc)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(shots, dtype=np.float32))
+        os.replace(tmp, path)
+
+    def load_shots(self, acc):
+        path = self._shots_path(acc)
+        return np.load(path) if os.path.exists(path) else None
+
+    def delete_shots(self, acc):
+        try:
+            os.remove(self._shots_path(acc))
+        except OSError:
+            pass
+
+    def open_matrix(self, rows):
+        """Memmap chỉ đọc rows hàng đầu của file generation đang dùng (sau load/append)."""
+        return np.memmap(self._data_path(self.generation), dtype=np.float32,
+                         mode="r", shape=(rows, self.dim))
+
+    @property
+    def ann_path(self):
+        """File index ANN lưu cạnh dữ liệu gallery."""
+        return os.path.join(self.dir, "ivf.npz")
+
+    def load(self):
+        """
+        Trả về (version, users, matrix, starts, live):
+        - matrix : np.memmap chỉ đọc (rows × dim) → khởi động gần như tức thì
+        - starts : vị trí bắt đầu từng đoạn hàng; live[i] = False nếu đoạn i là hàng đã xóa
+        """
+        for attempt in range(3):
+            index = self._read_index()
+            rows = index["rows"]
+            try:
+                if rows:
+                    matrix = np.memmap(self._data_path(index["generation"]), dtype=np.float32,
+                                       mode="r", shape=(rows, index["dim"]))
+                else:
+                    matrix = np.empty((0, index["dim"]), dtype=np.float32)
+                self.generation = index["generation"]
+                break
+            except FileNotFoundError:
+                # Worker khác vừa compact sang generation mới → đọc lại index
+                if attempt == 2:
+                    raise
+
+        users, starts, live = [], [], []
+        cursor = 0
+        for entry in sorted(index["users"], key=lambda u: u["start"]):
+            if entry["start"] > cursor:
+                starts.append(cursor)
+                live.append(False)
+            starts.append(entry["start"])
+            live.append(True)
+            cursor = entry["start"] + entry["count"]
+            users.append({k: v for k, v in entry.items() if k not in ("start", "count")})
+        if cursor < rows:
+            starts.append(cursor)
+            live.append(False)
+        return (index["version"], users, matrix,
+                np.array(starts, dtype=np.int64), np.array(live, dtype=bool))
+
+    # ====== GHI ======
+    def _commit(self, index):
+        index["version"] = read_version(self.dir) + 1
+        _write_atomic(os.path.join(self.dir, INDEX_FILE), json.dumps(index, ensure_ascii=False))
+        _write_atomic(os.path.join(self.dir, VERSION_FILE), str(index["version"]))
+        return index["version"]
+
+    def append(self, entries):
+        """
+        Ghi nối nhiều user: entries = [(meta, rows float32 đã chuẩn hóa)].
+        Trả về (version trước, version mới).
+        """
+        with _FileLock(self._lock_path):
+            index = self._read_index()
+            prev = read_version(self.dir)
+            existing = {u["acc"] for u in index["users"]}
+            for meta, _ in entries:
+                if meta["acc"] in existing:
+                    raise KeyError(f"Mã acc {meta['acc']} đã tồn tại")
+                existing.add(meta["acc"])
+            self._append_rows(index, entries)
+            return prev, self._commit(index)
+
+    def _append_rows(self, index, entries):
+        path = self._data_path(index["generation"])
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(index["rows"] * self.dim * 4)
+            for meta, rows in entries:
+                rows = np.ascontiguousarray(rows, dtype=np.float32)
+                if rows.ndim != 2 or rows.shape[1] != self.dim or len(rows) == 0:
+                    raise ValueError(f"Embedding của {meta['acc']} sai kích thước {rows.shape}")
+                f.write(rows.tobytes())
+                index["users"].append(dict(meta, start=index["rows"], count=len(rows)))
+                index["rows"] += len(rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self, acc):
+        """Xóa user khỏi index. Trả về (found, version trước, version mới, compacted)."""
+        with _FileLock(self._lock_path):
+            index = self._read_index()
+            prev = read_version(self.dir)
+            kept = [u for u in index["users"] if u["acc"] != acc]
+            if len(kept) == len(index["users"]):
+                return False, prev, prev, False
+            index["users"] = kept
+            compacted = self._maybe_compact(index)
+            return True, prev, self._commit(index), compacted
+
+    def replace(self, meta, rows):
+        """Thay embedding của user đã có (xóa + ghi nối trong 1 lần khóa)."""
+        with _FileLock(self._lock_path):
+            index = self._read_index()
+            prev = read_version(self.dir)
+            kept = [u for u in index["users"] if u["acc"] != meta["acc"]]
+            if len(kept) == len(index["users"]):
+                raise KeyError(f"Không tìm thấy acc {meta['acc']}")
+            index["users"] = kept
+            self._append_rows(index, [(meta, rows)])
+            compacted = self._maybe_compact(index)
+            return prev, self._commit(index), compacted
+
+    def _maybe_compact(self, index):
+        live_rows = sum(u["count"] for u in index["users"])
+        dead_rows = index["rows"] - live_rows
+        if dead_rows < 1024 or dead_rows < live_rows:
+            return False
+        self._compact(index)
+        return True
+
+    def _compact(self, index):
+        """Chép các hàng còn sống sang file generation mới (file cũ có thể đang được mmap)."""
+        old_path = self._data_path(index["generation"])
+        old = np.memmap(old_path, dtype=np.float32, mode="r", shape=(index["rows"], self.dim))
+        generation = index["generation"] + 1
+        new_path = self._data_path(generation)
+        cursor = 0
+        with open(new_path, "wb") as f:
+            for u in sorted(index["users"], key=lambda u: u["start"]):
+                f.write(np.ascontiguousarray(old[u["start"]:u["start"] + u["count"]]).tobytes())
+                u["start"] = cursor
+                cursor += u["count"]
+            f.flush()
+            os.fsync(f.fileno())
+        del old
+        index["generation"] = generation
+        index["rows"] = cursor
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass  # Windows: file còn được worker khác mmap, bỏ qua
@@ -0,0 +1,67 @@
+# gallery/templates.py
+import numpy as np
+
+TEMPLATE_DEFAULTS = {
+    "enabled": True,
+    "k": 3,                  # số template tối đa / user
+    "min_similarity": 0.3,   # shot có cosine với tâm < ngưỡng → loại
+    "mad_factor": 3.0,       # loại shot lệch quá mad_factor × MAD so với trung vị
+    "min_shots": 3,          # luôn giữ ít nhất bấy nhiêu shot tốt nhất
+}
+
+
+def _normalize(x):
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-8)
+
+
+def reject_outliers(shots, min_similarity=0.3, mad_factor=3.0, min_shots=3):
+    """
+    Loại shot xấu (mờ, sai người, lệch góc nặng) dựa trên cosine với tâm của các shot.
+    Trả về mask bool các shot được giữ.
+    """
+    n = len(shots)
+    if n <= min_shots:
+        return np.ones(n, dtype=bool)
+    center = _normalize(shots.mean(axis=0))
+    sims = shots @ center
+    median = np.median(sims)
+    mad = np.median(np.abs(sims - median)) * 1.4826
+    keep = (sims >= min_similarity) & (sims >= median - mad_factor * mad)
+    if keep.sum() < min_shots:
+        keep = np.zeros(n, dtype=bool)
+        keep[np.argsort(-sims)[:min_shots]] = True
+    return keep
+
+
+def cluster_shots(shots, k=3, iters=10):
+    """K-means cầu trên các shot của 1 user; trả về tối đa k centroid đã chuẩn hóa."""
+    k = min(k, len(shots))
+    if k <= 1:
+        return _normalize(shots.mean(axis=0, keepdims=True))
+    # Khởi tạo farthest-point: shot gần tâm nhất, rồi lần lượt shot xa các tâm đã chọn nhất
+    center = _normalize(shots.mean(axis=0))
+    chosen = [int(np.argmax(shots @ center))]
+    for _ in range(k - 1):
+        nearest = np.max(shots @ shots[chosen].T, axis=1)
+        chosen.append(int(np.argmin(nearest)))
+    centroids = shots[chosen].copy()
+    for _ in range(iters):
+        assign = np.argmax(shots @ centroids.T, axis=1)
+        for c in range(k):
+            members = shots[assign == c]
+            if len(members):
+                centroids[c] = _normalize(members.mean(axis=0))
+    # Bỏ cụm rỗng
+    used = np.unique(np.argmax(shots @ centroids.T, axis=1))
+    return centroids[used]
+
+
+def build_templates(shots, k=3, min_similarity=0.3, mad_factor=3.0, min_shots=3, **_):
+    """
+    Gom các shot đăng ký (n × dim, đã chuẩn hóa) thành ≤ k template đại diện.
+    Trả về (templates float32, mask shot được giữ).
+    """
+    shots = _normalize(np.asarray(shots, dtype=np.float32))
+    keep = reject_outliers(shots, min_similarity, mad_factor, min_shots)
+    templates = cluster_shots(shots[keep], k)
+    return np.ascontiguousarray(templates, dtype=np.float32), keep
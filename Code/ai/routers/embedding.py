@@ -0,0 +1,133 @@
+# routers/embedding.py
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException
+from typing import List, Optional
+import asyncio
+import base64
+import numpy as np
+import os
+
+router = APIRouter()
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detector.postprocess import select_face
+from utils import config
+from utils.executor import ServerBusy
+from utils.image_io import decode_for_detection
+from utils.model_registry import get_executor, get_result_cache, get_scheduler
+from utils.result_cache import MISS, content_key
+
+PADDING_RATIO = config.get("face_detection", "padding_ratio", 0.4)
+DETECT_SIDE = config.get("face_detection", "detect_side", 960)
+SELECT_MODE = config.get("face_detection", "select", "largest")
+ALIGNMENT = config.get("face_recognition", "alignment", "landmarks")
+MAX_IMAGES = 20
+DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+def encode_embedding(emb, dtype="float32"):
+    """Embedding → base64 của mảng little-endian (float32: 2 KB, float16: 1 KB với dim 512)."""
+    arr = np.asarray(emb, dtype=np.dtype(DTYPES[dtype]).newbyteorder("<")).ravel()
+    return base64.b64encode(arr.tobytes()).decode("ascii")
+
+
+def crop_main_face(img, faces, kpts=None):
+    """Căn chỉnh khuôn mặt chính (face_detection.select); trả về (crop, bbox trên ảnh gốc, det_score)."""
+    i = select_face(faces, img.image.shape, SELECT_MODE)
+    face = faces[i]
+    face_crop = img.crop(face, PADDING_RATIO, kpts=None if kpts is None else kpts[i], mode=ALIGNMENT)
+    return face_crop, img.to_full(face)[:4], round(float(face[4]), 3)
+
+
+async def embed_main_faces(contents):
+    """
+    Mặt chính của từng ảnh (bytes upload) → (crop, bbox, det_score, embedding); None nếu không có mặt,
+    MISS nếu ảnh không hợp lệ. Ảnh đã xử lý (cùng bytes) lấy từ cache, còn lại detect chung 1 lô
+    + ArcFace 1 lần. Trả về (entries, số ảnh lấy từ cache, decode_ms).
+    """
+    pool = get_executor()
+    scheduler = get_scheduler()
+    cache = get_result_cache()
+
+    keys = [content_key("face", c) for c in contents]
+    entries = [cache.get(k) for k in keys]
+    todo = [i for i, e in enumerate(entries) if e is MISS]
+
+    images = await asyncio.gather(*(pool.run(decode_for_detection, contents[i], DETECT_SIDE) for i in todo))
+    valid = [(i, img) for i, img in zip(todo, images) if img is not None]
+    all_faces = await asyncio.gather(*(scheduler.detect(img.image) for _, img in valid))
+    with_face = []
+    for (i, img), (faces, kpts) in zip(valid, all_faces):
+        if len(faces):
+            with_face.append((i, img, faces, kpts))
+        else:
+            entries[i] = None
+            cache.put(keys[i], None)
+
+    crops = await asyncio.gather(*(pool.run(crop_main_face, img, faces, kpts) for _, img, faces, kpts in with_face))
+    if crops:
+        try:
+            embs = await scheduler.embed([crop for crop, _, _ in crops])
+        except ServerBusy:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Lỗi khi trích embedding: {e}")
+        for (i, _, _, _), (crop, bbox, score), emb in zip(with_face, crops, embs):
+            # Chép embedding ra khỏi mảng cả lô → mục cache không giữ cả lô trong RAM
+            entries[i] = (crop, bbox, score, np.array(emb))
+            cache.put(keys[i], entries[i], nbytes=crop.nbytes + entries[i][3].nbytes)
+
+    return entries, len(contents) - len(todo), sum(img.decode_ms for img in images if img is not None)
+
+
+@router.post("/extract-embedding")
+async def extract_embedding(
+    files: Optional[List[UploadFile]] = File(None, description="1-20 ảnh khuôn mặt"),
+    file: Optional[UploadFile] = File(None, description="1 ảnh (tương thích client cũ)"),
+    dtype: str = Form("float32", description="float32 | float16"),
+):
+    """
+    Chỉ trích embedding (không so khớp, không lưu): detect mọi ảnh trong 1 lô, ArcFace 1 lần.
+    - Mỗi ảnh trả về 1 phần tử trong **results** (cùng thứ tự upload), embedding mã hóa base64
+    - **embedding**: embedding của ảnh hợp lệ đầu tiên (tiện cho request 1 ảnh)
+    - Ảnh đã gửi trước đó (cùng bytes) lấy kết quả từ cache, **cached**: số ảnh như vậy
+    """
+    uploads = list(files or []) + ([file] if file is not None else [])
+    if not uploads:
+        raise HTTPException(status_code=400, detail="Cần ít nhất 1 ảnh!")
+    if len(uploads) > MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Tối đa {MAX_IMAGES} ảnh!")
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype phải là {' hoặc '.join(DTYPES)}")
+
+    contents = [await f.read() for f in uploads]
+    entries, cached, decode_ms = await embed_main_faces(contents)
+
+    results = []
+    for i, entry in enumerate(entries):
+        if entry is MISS:
+            results.append({"index": i, "status": "invalid_image"})
+        elif entry is None:
+            results.append({"index": i, "status": "no_face"})
+        else:
+            _, bbox, score, emb = entry
+            results.append({
+                "index": i,
+                "status": "success",
+                "bbox": bbox,
+                "det_score": score,
+                "embedding": encode_embedding(emb, dtype),
+            })
+
+    embs = [entry[3] for entry in entries if entry is not MISS and entry is not None]
+    first = next((r["embedding"] for r in results if r["status"] == "success"), None)
+    return {
+        "status": "success" if first is not None else "failed",
+        "dtype": dtype,
+        "dim": len(embs[0]) if embs else None,
+        "count": len(embs),
+        "embedding": first,
+        "results": results,
+        "cached": cached,
+        "decode_ms": round(decode_ms, 1),
+    }
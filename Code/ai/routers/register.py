@@ -2,89 +2,66 @@
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException
 from fastapi.responses import JSONResponse
 from typing import List
+import asyncio
 import cv2
 import numpy as np
 import os
-import pickle
 from datetime import datetime
-from utils.crop_face import crop_face_expanded
 
 router = APIRouter()
 
 # Import models
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from detector.yolo_face import YOLOFace
-from embedder.arcface import ArcFace
+from gallery.face_gallery import get_gallery
+from routers.embedding import embed_main_faces
+from utils.model_registry import get_executor
+from utils.result_cache import MISS
 
-detector = YOLOFace()
-embedder = ArcFace()
-
-DATA_DIR = "data/users"
 IMG_SAVE_DIR = "data/images"
-os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(IMG_SAVE_DIR, exist_ok=True)
 
-@router.post("/register")
-async def register_user(
-    name: str = Form(..., description="Tên người dùng"),
-    acc: str = Form(..., description="Mã định danh (ID)"),
-    files: List[UploadFile] = File(..., description="5-20 ảnh khuôn mặt")
-):
-    """
-    Đăng ký người dùng mới
-    - **name**: Tên người dùng
-    - **acc**: Mã định danh duy nhất
-    - **files**: 5-20 ảnh khuôn mặt (JPG/PNG)
-    """
-    # === VALIDATION ===
+GALLERY = get_gallery()
+
+
+def validate_files(files):
     if len(files) < 5:
         raise HTTPException(status_code=400, detail="Cần ít nhất 5 ảnh!")
     if len(files) > 20:
         raise HTTPException(status_code=400, detail="Tối đa 20 ảnh!")
-    if os.path.exists(os.path.join(DATA_DIR, f"{acc}.pkl")):
-        raise HTTPException(status_code=400, detail="Mã acc đã tồn tại!")
 
-    embeddings = []
-    saved_images = []
 
-    for file in files:
-        if not file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            continue
+def save_crop(face_crop, acc):
+    """Lưu ảnh 112x112 (đã căn chỉnh) đưa vào ArcFace; trả về đường dẫn."""
+    user_img_dir = os.path.join(IMG_SAVE_DIR, acc)
+    os.makedirs(user_img_dir, exist_ok=True)
+    img_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+    img_path = os.path.join(user_img_dir, img_name)
+    cv2.imwrite(img_path, face_crop)
+    return img_path
 
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None:
-            continue
 
-        faces = detector.detect(frame)
-        if not faces:
+async def extract_user_data(name, acc, files):
+    """Detect + crop từng ảnh, embedding cả lô, trả về user_data và danh sách ảnh đã lưu."""
+    uploads = []
+    for file in files:
+        if not file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
             continue
+        uploads.append(await file.read())
 
-        # x1, y1, x2, y2, _ = faces[0]
-        x1, y1, x2, y2, _ = map(int, faces[0])
-        face_crop = frame[y1:y2, x1:x2]
-        face_crop, bbox_expanded = crop_face_expanded(frame, x1, y1, x2, y2)
-
-        # Lưu ảnh
-        user_img_dir = os.path.join(IMG_SAVE_DIR, acc)
-        os.makedirs(user_img_dir, exist_ok=True)
-        img_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
-        img_path = os.path.join(user_img_dir, img_name)
-        cv2.imwrite(img_path, face_crop)
-        saved_images.append(img_path)
-
-        # Embedding
-        try:
-            emb = embedder.get(face_crop)
-            embeddings.append(emb)
-        except:
-            continue
+    # Ảnh đã embed trước đó (backend gửi lại, /extract-embedding) lấy từ cache;
+    # còn lại decode giảm cho detect, detect chung 1 lô, ArcFace 1 lần
+    entries, cached, decode_ms = await embed_main_faces(uploads)
+    faces = [e for e in entries if e is not MISS and e is not None]
+    print(f"[REGISTER] {acc}: decode {decode_ms:.0f} ms / {len(uploads) - cached} ảnh, cache {cached} ảnh")
 
-    if len(embeddings) < 3:
+    if len(faces) < 3:
         raise HTTPException(status_code=400, detail="Không đủ ảnh hợp lệ (cần ≥3)")
 
+    pool = get_executor()
+    saved_images = list(await asyncio.gather(*(pool.run(save_crop, crop, acc) for crop, _, _, _ in faces)))
+    embeddings = [emb for _, _, _, emb in faces]
+
     mean_emb = np.mean(embeddings, axis=0)
     user_data = {
         "name": name,
@@ -94,14 +71,82 @@ async def register_user(
         "num_images": len(embeddings),
         "registered_at": datetime.now().isoformat()
     }
+    return user_data, saved_images
+
+
+@router.post("/register")
+async def register_user(
+    name: str = Form(..., description="Tên người dùng"),
+    acc: str = Form(..., description="Mã định danh (ID)"),
+    files: List[UploadFile] = File(..., description="5-20 ảnh khuôn mặt")
+):
+    """
+    Đăng ký người dùng mới
+    - **name**: Tên người dùng
+    - **acc**: Mã định danh duy nhất
+    - **files**: 5-20 ảnh khuôn mặt (JPG/PNG)
+    """
+    # === VALIDATION ===
+    validate_files(files)
+    await get_executor().run(GALLERY.refresh_if_stale)
+    if acc in GALLERY:
+        raise HTTPException(status_code=400, detail="Mã acc đã tồn tại!")
 
-    user_path = os.path.join(DATA_DIR, f"{acc}.pkl")
-    with open(user_path, "wb") as f:
-        pickle.dump(user_data, f)
+    user_data, saved_images = await extract_user_data(name, acc, files)
+
+    # Ghi nối vào file gallery + thêm vào gallery đang chạy → /verify thấy ngay
+    try:
+        await get_executor().run(GALLERY.add_user, user_data)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Mã acc đã tồn tại!")
 
     return JSONResponse({
         "status": "success",
-        "message": f"Đã đăng ký {name} ({acc}) với {len(embeddings)} ảnh",
+        "message": f"Đã đăng ký {name} ({acc}) với {user_data['num_images']} ảnh",
         "saved_images": saved_images[-5:],
-        "user_file": user_path
+        "gallery_version": GALLERY.version
     })
+
+
+@router.put("/register/{acc}")
+async def update_user(
+    acc: str,
+    name: str = Form(..., description="Tên người dùng"),
+    files: List[UploadFile] = File(..., description="5-20 ảnh khuôn mặt")
+):
+    """
+    Đăng ký lại khuôn mặt cho user đã có (thay toàn bộ embedding cũ)
+    """
+    validate_files(files)
+    await get_executor().run(GALLERY.refresh_if_stale)
+    if acc not in GALLERY:
+        raise HTTPException(status_code=404, detail="Không tìm thấy mã acc!")
+
+    user_data, saved_images = await extract_user_data(name, acc, files)
+    try:
+        await get_executor().run(GALLERY.replace_user, user_data)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Không tìm thấy mã acc!")
+
+    return JSONResponse({
+        "status": "success",
+        "message": f"Đã cập nhật {name} ({acc}) với {user_data['num_images']} ảnh",
+        "saved_images": saved_images[-5:],
+        "gallery_version": GALLERY.version
+    })
+
+
+@router.delete("/register/{acc}")
+async def delete_user(acc: str):
+    """
+    Xóa user khỏi gallery
+    """
+    pool = get_executor()
+    await pool.run(GALLERY.refresh_if_stale)
+    if not await pool.run(GALLERY.remove_user, acc):
+        raise HTTPException(status_code=404, detail="Không tìm thấy mã acc!")
+    return {
+        "status": "success",
+        "message": f"Đã xóa {acc}",
+        "gallery_version": GALLERY.version
+    }
@@ -0,0 +1,180 @@
+# routers/stream.py
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+import cv2
+import numpy as np
+import os
+import time
+
+router = APIRouter()
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detector.postprocess import select_face
+from routers.verify import (ALIGNMENT, DETECT_SIDE, GALLERY, LIVENESS_THRESHOLD, PADDING_RATIO,
+                            SIM_THRESHOLD, draw_results)
+from utils import config, metrics
+from utils.executor import ServerBusy
+from utils.image_io import decode_for_detection
+from utils.model_registry import get_executor, get_result_writer, get_scheduler
+
+MAX_FRAMES = config.get("stream", "max_frames", 10)
+MIN_FRAMES = config.get("stream", "min_frames", 1)
+TIMEOUT_S = config.get("stream", "timeout_s", 10)
+SHARPNESS_REF = config.get("stream", "sharpness_ref", 200)
+SELECT_MODE = config.get("face_detection", "select", "largest")
+
+
+def prepare_frame(img, faces, kpts):
+    """Mặt chính của frame → (crop 112x112, độ nét Laplacian, bbox, det_score)."""
+    i = select_face(faces, img.image.shape, SELECT_MODE)
+    face = faces[i]
+    face_crop = img.crop(face, PADDING_RATIO, kpts=None if kpts is None else kpts[i], mode=ALIGNMENT)
+    sharpness = cv2.Laplacian(cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var()
+    return face_crop, float(sharpness), tuple(int(v) for v in face[:4]), float(face[4])
+
+
+class StreamSession:
+    """
+    Gộp bằng chứng qua nhiều frame của 1 lần mở tủ:
+    - Mỗi frame hợp lệ (có mặt, qua liveness) góp embedding với trọng số = det_score × độ nét
+      (chuẩn hóa theo sharpness_ref) → embedding gộp ít nhiễu hơn từng frame riêng lẻ
+    - Sau mỗi frame so khớp embedding gộp; vượt ngưỡng (và đủ min_frames) → quyết định ngay
+    - Giữ frame nét nhất để lưu ảnh kết quả khi thất bại
+    """
+
+    def __init__(self, accs=None):
+        self.accs = accs
+        self.frames = 0
+        self.scored = 0
+        self.fakes = 0
+        self.no_face = 0
+        self.fused = None
+        self.match = (None, -1.0)
+        self.best = None  # (quality, frame index, ảnh, bbox)
+
+    def add(self, index, image, emb, sharpness, bbox, det_score):
+        w = det_score * min(1.0, sharpness / SHARPNESS_REF)
+        self.fused = emb * w if self.fused is None else self.fused + emb * w
+        self.scored += 1
+        if self.best is None or w > self.best[0]:
+            self.best = (w, index, image, bbox)
+        fused = self.fused / (np.linalg.norm(self.fused) + 1e-12)
+        frame_match = GALLERY.match(emb, top_k=1, accs=self.accs)
+        matches = GALLERY.match(fused, top_k=1, accs=self.accs)
+        self.match = matches[0] if matches else (None, -1.0)
+        return frame_match[0] if frame_match else (None, -1.0)
+
+    @property
+    def accepted(self):
+        user, score = self.match
+        return user is not None and score > SIM_THRESHOLD and self.scored >= MIN_FRAMES
+
+    def decision(self):
+        user, score = self.match
+        result = {
+            "type": "decision",
+            "frames": self.frames,
+            "scored_frames": self.scored,
+            "best_frame": self.best[1] if self.best else None,
+            "score": round(float(score), 3),
+        }
+        if self.accepted:
+            result.update(status="success", name=user.get("name", "Unknown"), acc=user.get("acc", "unknown"))
+        elif self.scored:
+            result["status"] = "failed"
+        else:
+            result["status"] = "fake" if self.fakes else "no_face"
+        return result
+
+
+async def process_frame(session, contents):
+    """Decode → detect → crop/độ nét → embed → gộp; trả về tin nhắn tiến độ của frame."""
+    pool = get_executor()
+    scheduler = get_scheduler()
+    index = session.frames
+    session.frames += 1
+
+    img = await pool.run(decode_for_detection, contents, DETECT_SIDE)
+    if img is None:
+        return {"type": "frame", "frame": index, "status": "invalid_image"}
+    with metrics.timer("detect"):
+        faces, kpts = await scheduler.detect(img.image)
+    if len(faces) == 0:
+        session.no_face += 1
+        return {"type": "frame", "frame": index, "status": "no_face"}
+
+    face_crop, sharpness, bbox, det_score = await pool.run(prepare_frame, img, faces, kpts)
+    if sharpness <= LIVENESS_THRESHOLD:
+        session.fakes += 1
+        metrics.FACES.inc("fake")
+        return {"type": "frame", "frame": index, "status": "fake"}
+
+    with metrics.timer("embed"):
+        emb = (await scheduler.embed([face_crop]))[0]
+    with metrics.timer("match"):
+        _, frame_score = await pool.run(session.add, index, img.image, emb, sharpness, bbox, det_score)
+    return {
+        "type": "frame",
+        "frame": index,
+        "status": "scored",
+        "score": round(float(frame_score), 3),
+        "fused_score": round(float(session.match[1]), 3),
+    }
+
+
+# ====== API STREAM ======
+@router.websocket("/verify/stream")
+async def verify_stream(ws: WebSocket, accs: str = None):
+    """
+    Verify nhiều frame trên 1 kết nối WebSocket (thiết bị gửi liên tiếp ảnh JPEG dạng binary):
+    - Mỗi frame nhận về {"type": "frame", "status": scored | no_face | fake | invalid_image, ...}
+    - Khi embedding gộp vượt ngưỡng → {"type": "decision", "status": "success", ...} rồi đóng kết nối
+    - Gửi text "end", hết max_frames hoặc quá timeout_s → decision với kết quả tốt nhất hiện có
+    - accs (query, vd ?accs=a1,a2): chỉ so với các user này như /verify
+    """
+    await ws.accept()
+    allow = [a.strip() for a in accs.split(",") if a.strip()] if accs else None
+    await get_executor().run(GALLERY.refresh_if_stale)
+    if not GALLERY or (allow is not None and not any(acc in GALLERY for acc in allow)):
+        await ws.send_json({"type": "error", "detail": "Chưa có người dùng hoặc không tìm thấy acc"})
+        await ws.close(code=1008)
+        return
+
+    session = StreamSession(allow)
+    t0 = time.perf_counter()
+    deadline = t0 + TIMEOUT_S
+    try:
+        while session.frames < MAX_FRAMES and not session.accepted:
+            try:
+                msg = await asyncio.wait_for(ws.receive(), timeout=max(deadline - time.perf_counter(), 0.001))
+            except asyncio.TimeoutError:
+                break
+            if msg["type"] == "websocket.disconnect":
+                return
+            if msg.get("bytes") is None:
+                break  # text "end" (hoặc bất kỳ tin nhắn text nào) → kết thúc phiên
+            await ws.send_json(await process_frame(session, msg["bytes"]))
+    except WebSocketDisconnect:
+        return
+    except ServerBusy as e:
+        await ws.send_json({"type": "error", "detail": str(e)})
+        await ws.close(code=1013)
+        return
+
+    result = session.decision()
+    elapsed = time.perf_counter() - t0
+    result["elapsed_ms"] = round(elapsed * 1000, 1)
+    metrics.STREAM_SESSIONS.inc(result["status"])
+    metrics.STREAM_FRAMES.observe(session.frames)
+    metrics.observe("stream_total", elapsed)
+
+    # Lưu frame nét nhất theo chính sách output (mặc định chỉ khi thất bại)
+    writer = get_result_writer()
+    if session.best is not None and writer.should_save(result["status"] != "success"):
+        _, _, image, bbox = session.best
+        label = f"{result.get('name', 'UNKNOWN')} ({result['score']:.2f})"
+        color = (0, 255, 0) if result["status"] == "success" else (0, 0, 255)
+        result["saved_file"] = writer.submit(image, draw_results, [(bbox, label, color)], prefix="stream")
+    await ws.send_json(result)
+    await ws.close()
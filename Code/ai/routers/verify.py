@@ -1,67 +1,42 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
+import copy
 import cv2
-import numpy as np
 import os
-import pickle
-from datetime import datetime
-from utils.crop_face import crop_face_expanded
+import time
 
 # ====== SETUP ======
 router = APIRouter()
-DATA_DIR = "data/users"
-OUTPUT_DIR = "output/verify"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ====== IMPORT MODULE ======
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from detector.yolo_face import YOLOFace
-from embedder.arcface import ArcFace
-
-detector = YOLOFace()
-embedder = ArcFace()
-
-# ====== UTILS ======
-def load_users():
-    users = []
-    if not os.path.exists(DATA_DIR):
-        return users
-    for file in os.listdir(DATA_DIR):
-        if file.endswith(".pkl"):
-            path = os.path.join(DATA_DIR, file)
-            try:
-                with open(path, "rb") as f:
-                    user = pickle.load(f)
-                    users.append(user)
-                    print(f"LOADED USER: {user.get('name', 'N/A')} - {user.get('acc', 'N/A')}")
-            except Exception as e:
-                print(f"LOAD USER ERROR {path}: {e}")
-    return users
-
-USERS = load_users()
-
-def cosine_similarity(a, b):
-    a = a / (np.linalg.norm(a) + 1e-8)
-    b = b / (np.linalg.norm(b) + 1e-8)
-    return np.dot(a, b)
-
-def get_user_embeddings(user):
-    """Lấy tất cả embedding từ user, bất kể cấu trúc."""
-    embs = []
-    if "embeddings" in user and isinstance(user["embeddings"], list):
-        embs.extend(user["embeddings"])
-    if "mean_embedding" in user:
-        embs.append(user["mean_embedding"])
-    if "embedding" in user:
-        embs.append(user["embedding"])
-    return [np.array(e) for e in embs if e is not None]
+from gallery.face_gallery import get_gallery
+from utils import config, metrics
+from utils.executor import ServerBusy
+from utils.image_io import decode_for_detection
+from utils.model_registry import get_executor, get_result_cache, get_result_writer, get_scheduler
+from utils.result_cache import MISS, content_key
+
+SIM_THRESHOLD = config.get("face_recognition", "similarity_threshold", 0.7)
+LIVENESS_THRESHOLD = config.get("liveness_detection", "laplacian_threshold", 50)
+PADDING_RATIO = config.get("face_detection", "padding_ratio", 0.4)
+DETECT_SIDE = config.get("face_detection", "detect_side", 960)
+ALIGNMENT = config.get("face_recognition", "alignment", "landmarks")
+# status trong response → nhãn result của metric face_api_faces_total
+FACE_RESULTS = {"success": "success", "failed": "unknown", "fake": "fake"}
+
+# ====== GALLERY ======
+GALLERY = get_gallery()
+metrics.register_gauge("face_api_gallery_users", "Số user trong gallery", lambda: len(GALLERY))
+metrics.register_gauge("face_api_gallery_embeddings", "Số vector (template) trong gallery",
+                       lambda: GALLERY.num_embeddings)
 
 def detect_liveness(face_crop):
     """Kiểm tra giả mạo qua độ tương phản (Laplacian variance)."""
     gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
     laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var > 50  # người thật
+    return laplacian_var > LIVENESS_THRESHOLD  # người thật
 
 def safe_putText(frame, text, pos, color=(0,255,0), scale=0.8, thick=2):
     """Vẽ chữ an toàn, không tràn khung."""
@@ -73,88 +48,189 @@ def safe_putText(frame, text, pos, color=(0,255,0), scale=0.8, thick=2):
     y = max(h, min(y, h_frame))
     cv2.putText(frame, text, (x, y), font, scale, color, thick)
 
-# ====== API VERIFY ======
-@router.post("/verify")
-async def verify_face(file: UploadFile = File(...)):
-    if not USERS:
-        raise HTTPException(status_code=400, detail="Chưa có người dùng! Hãy chạy đăng ký trước.")
-
-    # Đọc ảnh upload
-    contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if frame is None:
-        raise HTTPException(status_code=400, detail="Ảnh không hợp lệ!")
-
-    faces = detector.detect(frame)
-    if not faces:
-        return {"status": "failed", "message": "Không phát hiện khuôn mặt"}
+def draw_results(frame, annotations):
+    """Vẽ khung + nhãn lên ảnh (chạy trên thread ghi ảnh nền)."""
+    for (x1, y1, x2, y2), label, color in annotations:
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        safe_putText(frame, label, (x1, y1 - 10), color=color)
 
-    # Xử lý từng khuôn mặt
-    best_user = None
-    best_score = -1
-    result_info = []
+# ====== CÁC BƯỚC XỬ LÝ (chạy trong thread pool) ======
+def prepare_faces(img, faces, kpts=None):
+    """Căn chỉnh + kiểm tra giả mạo; trả về result_info (đã điền FAKE), các khuôn mặt thật và nhãn cần vẽ."""
+    result_info = [None] * len(faces)
+    live_faces = []
+    annotations = []
 
     for i, face in enumerate(faces):
         x1, y1, x2, y2, _ = map(int, face)
-        face_crop, _ = crop_face_expanded(frame, x1, y1, x2, y2)
+        with metrics.timer("align"):
+            face_crop = img.crop(face, PADDING_RATIO, kpts=None if kpts is None else kpts[i], mode=ALIGNMENT)
 
         # Kiểm tra giả mạo
-        if not detect_liveness(face_crop):
-            color = (0, 0, 255)
-            label = "FAKE"
-            safe_putText(frame, label, (x1, y1 - 10), color=color)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            result_info.append({"face": i, "status": "fake"})
+        with metrics.timer("liveness"):
+            live = detect_liveness(face_crop)
+        if not live:
+            metrics.FACES.inc("fake")
+            annotations.append(((x1, y1, x2, y2), "FAKE", (0, 0, 255)))
+            result_info[i] = {"face": i, "status": "fake"}
             continue
 
-        try:
-            emb = embedder.get(face_crop)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Lỗi khi trích embedding: {e}")
-
-        # So sánh với tất cả user
-        for user in USERS:
-            user_embs = get_user_embeddings(user)
-            if not user_embs:
-                continue
-            sims = [cosine_similarity(emb, ue) for ue in user_embs]
-            max_sim = max(sims)
-            if max_sim > best_score:
-                best_score = max_sim
-                best_user = user
-
-        # Hiển thị kết quả
-        if best_user and best_score > 0.7:
+        live_faces.append((i, (x1, y1, x2, y2), face_crop))
+    return result_info, live_faces, annotations
+
+
+def match_faces(live_faces, embs, result_info, annotations, accs=None):
+    """So khớp embedding với gallery (hoặc chỉ các user trong accs), điền result_info + nhãn cần vẽ."""
+    for (i, bbox, _), emb in zip(live_faces, embs):
+        # accs=None: so với toàn bộ gallery (1 phép nhân ma trận); có accs: chỉ hàng của các user đó
+        best_user, best_score = None, -1
+        with metrics.timer("match"):
+            matches = GALLERY.match(emb, top_k=1, accs=accs)
+        if matches:
+            best_user, best_score = matches[0]
+
+        # Kết quả
+        if best_user and best_score > SIM_THRESHOLD:
+            metrics.FACES.inc("success")
             name = best_user.get("name", "Unknown")
             acc = best_user.get("acc", "unknown")
-            color = (0, 255, 0)
-            label = f"{name} ({best_score:.2f})"
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            safe_putText(frame, label, (x1, y1 - 10), color=color)
-            result_info.append({
+            annotations.append((bbox, f"{name} ({best_score:.2f})", (0, 255, 0)))
+            result_info[i] = {
                 "face": i,
                 "status": "success",
                 "name": name,
                 "acc": acc,
                 "score": round(float(best_score), 3)
-            })
+            }
         else:
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-            safe_putText(frame, "UNKNOWN", (x1, y1 - 10), color=(0, 0, 255))
-            result_info.append({
+            metrics.FACES.inc("unknown")
+            annotations.append((bbox, "UNKNOWN", (0, 0, 255)))
+            result_info[i] = {
                 "face": i,
                 "status": "failed",
                 "score": round(float(best_score), 3)
-            })
+            }
 
-    # === Lưu ảnh kết quả ===
-    filename = os.path.join(OUTPUT_DIR, f"verify_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-    cv2.imwrite(filename, frame)
-    print(f"[INFO] Ảnh kết quả đã lưu tại: {filename}")
 
-    return JSONResponse({
+def replay_cached(cached):
+    """Response đã cache → bản sao cho request retry; vẫn đếm metric mặt như 1 request thường."""
+    result = copy.deepcopy(cached)
+    faces = result.get("faces", [])
+    metrics.FACES_PER_REQUEST.observe(len(faces))
+    for face in faces:
+        metrics.FACES.inc(FACE_RESULTS[face["status"]])
+    if "saved_file" in result:
+        result["saved_file"] = None  # ảnh kết quả thuộc về request đầu, retry không lưu lại
+    result["cached"] = True
+    return result
+
+
+# ====== API VERIFY ======
+@router.post("/verify")
+async def verify_face(file: UploadFile = File(...), accs: str = Form(None),
+                      save_image: bool = Form(None)):
+    """
+    1:N trên toàn bộ gallery; nếu gửi kèm accs (vd "a1,a2,a3" - danh sách người được mở tủ)
+    thì chỉ so với các user đó.
+    save_image: true/false để bắt buộc lưu / không lưu ảnh kết quả (mặc định theo config output.save).
+    """
+    allow = [a.strip() for a in accs.split(",") if a.strip()] if accs else None
+    return JSONResponse(await _verify(file, allow, save_image))
+
+
+@router.post("/verify/{acc}")
+async def verify_claimed(acc: str, file: UploadFile = File(...), save_image: bool = Form(None)):
+    """1:1: chỉ so với template của user acc, trả về quyết định match."""
+    result = await _verify(file, [acc], save_image)
+    result["acc"] = acc
+    result["match"] = any(f and f.get("status") == "success" for f in result.get("faces", []))
+    return JSONResponse(result)
+
+
+async def _verify(file, accs, save_image=None):
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        result = await _verify_stages(file, accs, save_image)
+        status = result["status"] if result["status"] == "success" else "no_face"
+        return result
+    except HTTPException as e:
+        status = "rejected" if e.status_code < 500 else "error"
+        raise
+    except ServerBusy:
+        status = "busy"
+        raise
+    finally:
+        metrics.REQUESTS.inc(status)
+        metrics.observe("total", time.perf_counter() - t0)
+
+
+async def _verify_stages(file, accs, save_image=None):
+    # Worker khác vừa register/xóa → nạp lại
+    await get_executor().run(GALLERY.refresh_if_stale)
+    if not GALLERY:
+        raise HTTPException(status_code=400, detail="Chưa có người dùng! Hãy chạy đăng ký trước.")
+    if accs is not None and not any(acc in GALLERY for acc in accs):
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy acc {', '.join(accs)}")
+
+    # Decode/crop chạy trong thread pool, detect/embed trên thread của scheduler
+    # (gom lô với các request đồng thời); vẽ + ghi ảnh kết quả trên thread nền
+    pool = get_executor()
+    scheduler = get_scheduler()
+
+    # Đọc ảnh upload
+    with metrics.timer("upload_read"):
+        contents = await file.read()
+
+    # Thiết bị retry cùng 1 ảnh (cùng gallery version, accs) → trả lại kết quả lần trước
+    cache = get_result_cache()
+    key = content_key("verify", contents, GALLERY.version, accs, save_image)
+    cached = cache.get(key)
+    if cached is not MISS:
+        return replay_cached(cached)
+
+    img = await pool.run(decode_for_detection, contents, DETECT_SIDE)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Ảnh không hợp lệ!")
+
+    # Detect trên ảnh đã giảm lúc decode; crop lại từ ảnh gốc khi mặt quá nhỏ
+    with metrics.timer("detect"):
+        faces, kpts = await scheduler.detect(img.image)
+    metrics.FACES_PER_REQUEST.observe(len(faces))
+    if len(faces) == 0:
+        metrics.observe("decode", img.decode_ms / 1000)
+        result = {"status": "failed", "message": "Không phát hiện khuôn mặt"}
+        cache.put(key, copy.deepcopy(result), nbytes=256)
+        return result
+
+    # Xử lý từng khuôn mặt: lọc giả mạo trước, gom crop người thật
+    result_info, live_faces, annotations = await pool.run(prepare_faces, img, faces, kpts)
+
+    # Embedding tất cả khuôn mặt thật bằng 1 lần suy luận
+    try:
+        with metrics.timer("embed"):
+            embs = await scheduler.embed([crop for _, _, crop in live_faces])
+    except ServerBusy:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi trích embedding: {e}")
+
+    await pool.run(match_faces, live_faces, embs, result_info, annotations, accs)
+
+    # Chỉ lưu ảnh khi request yêu cầu hoặc theo chính sách (mặc định: chỉ ca thất bại/giả mạo)
+    writer = get_result_writer()
+    failed = any(r["status"] != "success" for r in result_info)
+    filename = writer.submit(img.image, draw_results, annotations) if writer.should_save(failed, save_image) else None
+    # decode_ms gồm cả lần decode lại ảnh gốc (mặt nhỏ) trong bước căn chỉnh
+    metrics.observe("decode", img.decode_ms / 1000)
+
+    result = {
         "status": "success",
         "faces": result_info,
-        "saved_file": filename
-    })
+        "saved_file": filename,
+        "decode_ms": round(img.decode_ms, 1),
+        "gallery_version": GALLERY.version
+    }
+    # Lưu bản sao: verify_claimed thêm acc/match vào response trả về
+    cache.put(key, copy.deepcopy(result), nbytes=256 * (1 + len(result_info)))
+    return result
@@ -1,19 +1,23 @@
 import cv2
 import sys
 import os
-import pickle
 import numpy as np
 from datetime import datetime
 
 # Cho phép import từ thư mục gốc
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from detector.yolo_face import YOLOFace
-from embedder.arcface import ArcFace
-from utils.crop_face import crop_face_expanded  # CROP RỘNG
+from utils.align import align_face
+from detector.postprocess import select_face
+from gallery.face_gallery import FaceGallery
+from utils import config
+from utils.model_registry import get_detector, get_embedder
+from utils.tracker import FaceTracker
 
-DATA_DIR = "data/users"
 IMG_SAVE_DIR = "data/images"
+PADDING_RATIO = config.get("face_detection", "padding_ratio", 0.4)
+SELECT_MODE = config.get("face_detection", "select", "largest")
+ALIGNMENT = config.get("face_recognition", "alignment", "landmarks")
 
 def register():
     name = input("Nhập tên: ").strip()
@@ -24,16 +28,17 @@ def register():
         return
 
     # Kiểm tra acc đã tồn tại
-    if os.path.exists(os.path.join(DATA_DIR, f"{acc}.pkl")):
+    gallery = FaceGallery.from_config()
+    if acc in gallery:
         print(f"Mã {acc} đã tồn tại! Vui lòng chọn mã khác.")
         return
 
-    os.makedirs(DATA_DIR, exist_ok=True)
     user_img_dir = os.path.join(IMG_SAVE_DIR, acc)
     os.makedirs(user_img_dir, exist_ok=True)
 
-    detector = YOLOFace()
-    embedder = ArcFace()
+    detector = get_detector()
+    tracker = FaceTracker.from_config(detector)
+    embedder = get_embedder()
     cap = cv2.VideoCapture(0)
 
     if not cap.isOpened():
@@ -57,7 +62,10 @@ def register():
             print("Không đọc được khung hình!")
             break
 
-        faces = detector.detect(frame)
+        # Preview chỉ cần box → bám track, detector chạy mỗi detect_every frame
+        tracks = tracker.update(frame)
+        boxes = np.stack([t.box for t in tracks]) if tracks else np.empty((0, 5), dtype=np.float32)
+        main = select_face(boxes, frame.shape, SELECT_MODE)  # -1 = không có mặt
         display = frame.copy()
 
         status = f"Anh: {img_count}/{required_max} (it nhat {required_min})"
@@ -66,13 +74,10 @@ def register():
         cv2.putText(display, status, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
         cv2.putText(display, "SPACE: Chup | Q: Ket thuc", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
-        if faces:
+        if main >= 0:
             # ÉP KIỂU INT
-            x1, y1, x2, y2, _ = map(int, faces[0])
+            x1, y1, x2, y2, _ = map(int, boxes[main])
             cv2.rectangle(display, (x1, y1), (x2, y2), (0, 255, 0), 3)
-
-            # CROP RỘNG
-            face_crop_expanded, bbox_expanded = crop_face_expanded(frame, x1, y1, x2, y2)
             cv2.putText(display, "READY - SPACE TO CAPTURE", (x1, max(30, y1 - 10)),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
@@ -80,7 +85,7 @@ def register():
         key = cv2.waitKey(1) & 0xFF
 
         if key == ord(' '):
-            if not faces:
+            if main < 0:
                 print("Không phát hiện khuôn mặt, thử lại...")
                 continue
 
@@ -88,9 +93,16 @@ def register():
                 print(f"Đã đủ {required_max} ảnh!")
                 continue
 
-            # Lấy bbox và crop rộng
-            x1, y1, x2, y2, _ = map(int, faces[0])
-            face_crop_expanded, _ = crop_face_expanded(frame, x1, y1, x2, y2)
+            # Ảnh đăng ký cần landmark chính xác → detect đầy đủ đúng frame được chụp
+            faces, kpts = detector.detect(frame, landmarks=True)
+            main = select_face(faces, frame.shape, SELECT_MODE)
+            if main < 0:
+                print("Không phát hiện khuôn mặt, thử lại...")
+                continue
+
+            # Căn chỉnh 5 điểm (hoặc crop rộng theo box) về 112x112
+            face_crop_expanded = align_face(frame, faces[main], None if kpts is None else kpts[main],
+                                            PADDING_RATIO, ALIGNMENT)
 
             # Embedding
             try:
@@ -124,21 +136,20 @@ def register():
     user_data = {
         "name": name,
         "acc": acc,
-        "embeddings": [e.tolist() for e in embeddings],  # Lưu tất cả
+        "embeddings": embeddings,  # Lưu tất cả
         "mean_embedding": mean_emb.tolist(),
         "num_images": len(embeddings),
         "registered_at": datetime.now().isoformat()
     }
 
-    user_path = os.path.join(DATA_DIR, f"{acc}.pkl")
-    with open(user_path, "wb") as f:
-        pickle.dump(user_data, f)
+    # Ghi nối vào file gallery + tăng version → API đang chạy tự nạp lại
+    gallery.add_user(user_data)
 
     print(f"\nĐăng ký thành công!")
     print(f" - Tên: {name}")
     print(f" - Mã: {acc}")
     print(f" - Số ảnh: {len(embeddings)}")
-    print(f" - File: {user_path}")
+    print(f" - Gallery: {gallery.storage.dir} (version {gallery.version})")
 
 if __name__ == "__main__":
     register()
@@ -1,61 +1,35 @@
 import cv2
 import sys
 import os
-import pickle
 import numpy as np
 from datetime import datetime
 
 # Cho phép import từ thư mục gốc
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from detector.yolo_face import YOLOFace
-from embedder.arcface import ArcFace
-from utils.crop_face import crop_face_expanded  # CROP RỘNG
+from utils.align import align_face
+from detector.postprocess import select_face
+from gallery.face_gallery import get_gallery
+from utils import config
+from utils.model_registry import get_detector, get_embedder
+from utils.tracker import FaceTracker
 
-DATA_DIR = "data/users"
 OUTPUT_DIR = "output/verify"
+SIM_THRESHOLD = config.get("face_recognition", "similarity_threshold", 0.7)
+LIVENESS_THRESHOLD = config.get("liveness_detection", "laplacian_threshold", 50)
+PADDING_RATIO = config.get("face_detection", "padding_ratio", 0.4)
+SELECT_MODE = config.get("face_detection", "select", "largest")
+ALIGNMENT = config.get("face_recognition", "alignment", "landmarks")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # =====================
 # Utility functions
 # =====================
 
-def load_users():
-    users = []
-    if not os.path.exists(DATA_DIR):
-        return users
-    for file in os.listdir(DATA_DIR):
-        if file.endswith(".pkl"):
-            path = os.path.join(DATA_DIR, file)
-            try:
-                with open(path, "rb") as f:
-                    user = pickle.load(f)
-                    users.append(user)
-                    print(f"LOADED USER: {user.get('name', 'N/A')} - {user.get('acc', 'N/A')}")
-            except Exception as e:
-                print(f"LOAD USER ERROR {path}: {e}")
-    return users
-
-def cosine_similarity(a, b):
-    a = a / (np.linalg.norm(a) + 1e-8)
-    b = b / (np.linalg.norm(b) + 1e-8)
-    return np.dot(a, b)
-
-def get_user_embeddings(user):
-    """Lấy tất cả embedding từ user, bất kể cấu trúc"""
-    embs = []
-    if "embeddings" in user and isinstance(user["embeddings"], list):
-        embs.extend(user["embeddings"])
-    if "mean_embedding" in user:
-        embs.append(user["mean_embedding"])
-    if "embedding" in user:
-        embs.append(user["embedding"])
-    return [np.array(e) for e in embs if e is not None]
-
 def detect_liveness(face_crop):
     gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
     laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var > 50  # Người thật
+    return laplacian_var > LIVENESS_THRESHOLD  # Người thật
 
 def safe_putText(frame, text, pos, font, scale, color, thickness):
     (w, h), _ = cv2.getTextSize(text, font, scale, thickness)
@@ -65,18 +39,34 @@ def safe_putText(frame, text, pos, font, scale, color, thickness):
     y = max(h, min(y, h_frame))
     cv2.putText(frame, text, (x, y), font, scale, color, thickness)
 
+def identify(face_crop, gallery, embedder):
+    """Liveness → embedding → so khớp gallery; trả về (status, user, score) để cache theo track."""
+    if not detect_liveness(face_crop):
+        return "fake", None, -1.0
+    try:
+        emb = embedder.get(face_crop)
+    except Exception as e:
+        print("Lỗi embedding:", e)
+        return "error", None, -1.0
+    # SO SÁNH VỚI TẤT CẢ EMBEDDING (1 phép nhân ma trận)
+    matches = gallery.match(emb, top_k=1)
+    if not matches:
+        return "unknown", None, -1.0
+    best_user, best_score = matches[0]
+    return "scored", best_user, float(best_score)
+
 # =====================
 # Main verify logic
 # =====================
 
 def verify():
-    users = load_users()
-    if not users:
+    gallery = get_gallery()
+    if not gallery:
         print("CHƯA CÓ NGƯỜI DÙNG! Chạy register.py trước.")
         return
 
-    detector = YOLOFace()
-    embedder = ArcFace()
+    tracker = FaceTracker.from_config(get_detector())
+    embedder = get_embedder()
     cap = cv2.VideoCapture(0)
 
     if not cap.isOpened():
@@ -96,63 +86,55 @@ def verify():
                 break
             continue
 
-        faces = detector.detect(frame)
+        version = gallery.version
+        gallery.refresh_if_stale()
+        if gallery.version != version:
+            tracker.forget()  # gallery đổi → danh tính đã cache không còn đúng
+        # Detector chỉ chạy mỗi detect_every frame, frame ở giữa bám theo optical flow
+        tracks = tracker.update(frame)
         display = frame.copy()
 
-        if not faces:
+        if not tracks:
             cv2.putText(display, "NO FACE DETECTED", (10, 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
         else:
             # ÉP KIỂU INT
-            x1, y1, x2, y2, _ = map(int, faces[0])
+            main = select_face(np.stack([t.box for t in tracks]), frame.shape, SELECT_MODE)
+            track = tracks[main]
+            x1, y1, x2, y2, _ = map(int, track.box)
             cv2.rectangle(display, (x1, y1), (x2, y2), (0, 255, 0), 3)
 
-            # CROP RỘNG
-            face_crop, _ = crop_face_expanded(frame, x1, y1, x2, y2)
+            # Chỉ embed lại khi track mới, danh tính cache quá cũ hoặc mặt rõ hơn đáng kể
+            if track.needs_embedding(tracker.opts["reembed_age_s"], tracker.opts["reembed_gain"]):
+                # Căn chỉnh 5 điểm (hoặc crop rộng theo box) về 112x112
+                face_crop = align_face(frame, track.box, track.kpts, PADDING_RATIO, ALIGNMENT)
+                track.remember(identify(face_crop, gallery, embedder))
+            status, best_user, best_score = track.identity
 
             # === CHỐNG GIẢ MẠO ===
-            if not detect_liveness(face_crop):
+            if status == "fake":
                 safe_putText(display, "SPOOF DETECTED", (x1, y1 - 10),
                              cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 3)
                 cv2.putText(display, "FAKE", (10, 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
+            elif status == "error":
+                safe_putText(display, "ERROR", (x1, y1 - 10),
+                             cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            # HIỂN THỊ KẾT QUẢ
+            elif best_user and best_score > SIM_THRESHOLD:
+                name = best_user.get("name", "Unknown")
+                acc = best_user.get("acc", "unknown")
+                safe_putText(display, name, (x1, y1 - 40),
+                             cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
+                safe_putText(display, f"{acc} [{best_score:.3f}]", (x1, y1 - 10),
+                             cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
+                cv2.putText(display, "VERIFIED", (10, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
             else:
-                try:
-                    emb = embedder.get(face_crop)
-                    best_score = -1
-                    best_user = None
-
-                    # SO SÁNH VỚI TẤT CẢ EMBEDDING
-                    for user in users:
-                        user_embs = get_user_embeddings(user)
-                        if not user_embs:
-                            continue
-                        sims = [cosine_similarity(emb, ue) for ue in user_embs]
-                        max_sim = max(sims)
-                        if max_sim > best_score:
-                            best_score = max_sim
-                            best_user = user
-
-                    # HIỂN THỊ KẾT QUẢ
-                    if best_user and best_score > 0.7:
-                        name = best_user.get("name", "Unknown")
-                        acc = best_user.get("acc", "unknown")
-                        safe_putText(display, name, (x1, y1 - 40),
-                                     cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
-                        safe_putText(display, f"{acc} [{best_score:.3f}]", (x1, y1 - 10),
-                                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
-                        cv2.putText(display, "VERIFIED", (10, 30),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
-                    else:
-                        safe_putText(display, "UNKNOWN", (x1, y1 - 10),
-                                     cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 3)
-                        cv2.putText(display, f"Score: {best_score:.3f}", (10, 30),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
-
-                except Exception as e:
-                    print("Lỗi embedding:", e)
-                    safe_putText(display, "ERROR", (x1, y1 - 10),
-                                 cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                safe_putText(display, "UNKNOWN", (x1, y1 - 10),
+                             cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 3)
+                cv2.putText(display, f"Score: {best_score:.3f}", (10, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
 
         # Hiển thị
         cv2.putText(display, "s=save | q=quit", (10, 470), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 2)
@@ -168,6 +150,7 @@ def verify():
 
     cap.release()
     cv2.destroyAllWindows()
+    print(f"[TRACK] {tracker.stats()}")
     print("ĐÃ THOÁT AN TOÀN!")
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+# tools/bench_quantization.py
+"""
+So sánh gallery float32 / float16 / int8 trên dữ liệu tổng hợp:
+RAM, thời gian so khớp, độ lệch điểm và tỉ lệ top-1 khác float32.
+
+    python tools/bench_quantization.py
+    python tools/bench_quantization.py --users 200000 --shots 5 --probes 500
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from gallery.face_gallery import FaceGallery, l2_normalize
+
+
+def synthetic(users, shots, dim, probes, noise, seed=0):
+    """Mỗi user = 1 vector danh tính + shots bản nhiễu; probe = bản nhiễu mới của user ngẫu nhiên."""
+    rng = np.random.default_rng(seed)
+    ids = l2_normalize(rng.standard_normal((users, dim), dtype=np.float32))
+    rows = np.repeat(ids, shots, axis=0)
+    rows += noise * rng.standard_normal(rows.shape, dtype=np.float32) / np.sqrt(dim)
+    truth = rng.integers(0, users, probes)
+    q = ids[truth] + noise * rng.standard_normal((probes, dim), dtype=np.float32) / np.sqrt(dim)
+    metas = [{"acc": f"u{i}", "name": f"User {i}"} for i in range(users)]
+    return metas, rows, [shots] * users, l2_normalize(q), truth
+
+
+def run(gallery, probes):
+    results, times = [], []
+    for q in probes:
+        t0 = time.perf_counter()
+        results.append(gallery.match(q, top_k=1)[0])
+        times.append((time.perf_counter() - t0) * 1000)
+    return results, np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gallery nén float16/int8")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--shots", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.8)
+    parser.add_argument("--rerank", type=int, default=32)
+    args = parser.parse_args()
+
+    metas, rows, counts, probes, truth = synthetic(args.users, args.shots, args.dim, args.probes, args.noise)
+    print(f"Gallery: {args.users} user × {args.shots} = {len(rows)} vector, dim {args.dim}")
+
+    baseline = None
+    for precision in ("float32", "float16", "int8"):
+        gallery = FaceGallery.from_matrix(metas, rows, counts, args.dim, ann={"enabled": False},
+                                          quantization={"precision": precision, "rerank": args.rerank})
+        results, times = run(gallery, probes)
+        accs = np.array([int(u["acc"][1:]) for u, _ in results])
+        scores = np.array([s for _, s in results])
+        line = (f"{precision:8s} RAM {gallery.memory / 2**20:8.1f} MB | "
+                f"p50 {np.percentile(times, 50):6.2f} ms p95 {np.percentile(times, 95):6.2f} ms | "
+                f"top-1 đúng {np.mean(accs == truth) * 100:5.1f}%")
+        coarse = gallery.user_scores(probes[0])
+        if baseline is None:
+            baseline = (accs, scores, coarse)
+        else:
+            # Điểm cuối đã re-rank bằng float32 → lệch chỉ xảy ra khi bản nén loại nhầm ứng viên
+            line += (f" | khác float32 {np.mean(accs != baseline[0]) * 100:.2f}%"
+                     f" | lệch điểm {np.max(np.abs(scores - baseline[1])):.1e}"
+                     f" (thô {np.max(np.abs(coarse - baseline[2])):.1e})")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# tools/benchmark.py
+"""
+Benchmark từng bước của pipeline trên dữ liệu tổng hợp (chạy offline, seed cố định):
+detect, align (crop), tiền xử lý ArcFace, ArcFace get / get_batch, liveness,
+so khớp gallery 1k / 10k / 100k embedding. In p50/p95/p99 (ms) và throughput.
+
+    python tools/benchmark.py                       # chạy + in bảng
+    python tools/benchmark.py --save                # ghi baseline (tools/bench_baseline.json)
+    python tools/benchmark.py --compare             # so với baseline, mã lỗi 1 nếu chậm hơn --tolerance
+    python tools/benchmark.py --stages match --sizes 1000,10000 --repeat 500
+
+Baseline phụ thuộc phần cứng + config: tạo trên đúng máy deploy, chạy --compare trước khi deploy.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import config
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+STAGES = ("detect", "align", "preprocess", "embed", "embed_batch", "liveness", "match")
+BATCH = 16
+
+
+def synthetic_frame(rng, h=480, w=640):
+    """Nền nhiễu mờ + 1 hình "mặt" (ellipse sáng, 2 mắt, miệng) ở giữa khung."""
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (7, 7), 2)
+    cx, cy = w // 2 + int(rng.integers(-40, 40)), h // 2 + int(rng.integers(-30, 30))
+    cv2.ellipse(frame, (cx, cy), (70, 95), 0, 0, 360, (150, 170, 200), -1)
+    for dx in (-28, 28):
+        cv2.circle(frame, (cx + dx, cy - 25), 8, (40, 40, 40), -1)
+    cv2.ellipse(frame, (cx, cy + 40), (25, 8), 0, 0, 360, (60, 60, 150), -1)
+    return frame
+
+
+def synthetic_face(frame, rng):
+    """Box + 5 landmark quanh tâm khung (không cần detector)."""
+    h, w = frame.shape[:2]
+    cx, cy = w / 2, h / 2
+    box = np.array([cx - 70, cy - 95, cx + 70, cy + 95, 0.9], dtype=np.float32)
+    kpts = np.array([[cx - 28, cy - 25], [cx + 28, cy - 25], [cx, cy + 5],
+                     [cx - 22, cy + 40], [cx + 22, cy + 40]], dtype=np.float32)
+    return box, kpts + rng.normal(0, 2, kpts.shape).astype(np.float32)
+
+
+def measure(fn, inputs, repeat, warmup=3):
+    """Gọi fn(x) lần lượt trên inputs (quay vòng) repeat lần; trả về mảng thời gian ms / lần gọi."""
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    times = np.empty(repeat)
+    for i in range(repeat):
+        x = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(x)
+        times[i] = (time.perf_counter() - t0) * 1000
+    return times
+
+
+def summarize(times, items=1):
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 4),
+        "p95_ms": round(float(np.percentile(times, 95)), 4),
+        "p99_ms": round(float(np.percentile(times, 99)), 4),
+        "throughput": round(items * 1000 / float(np.mean(times)), 1),  # item/giây (ảnh, crop, query)
+        "runs": len(times),
+    }
+
+
+def gallery_for(size, dim, rng):
+    from gallery.face_gallery import FaceGallery
+    rows = rng.standard_normal((size, dim), dtype=np.float32)
+    users = [{"acc": f"u{i}", "name": f"User {i}"} for i in range(size)]
+    return FaceGallery.from_matrix(users, rows, [1] * size, dim,
+                                   ann=config.get("gallery", "ann"),
+                                   quantization=config.get("gallery", "quantization"))
+
+
+def run(stages, sizes, repeat, seed=0):
+    from utils.align import align_face
+
+    rng = np.random.default_rng(seed)
+    frames = [synthetic_frame(rng) for _ in range(8)]
+    faces = [synthetic_face(f, rng) for f in frames]
+    mode = config.get("face_recognition", "alignment", "landmarks")
+    padding = config.get("face_detection", "padding_ratio", 0.4)
+    crops = [align_face(f, box, kpts, padding, mode) for f, (box, kpts) in zip(frames, faces)]
+    results = {}
+
+    def record(name, times, items=1):
+        results[name] = summarize(times, items)
+        r = results[name]
+        print(f"{name:22s} p50 {r['p50_ms']:9.3f}  p95 {r['p95_ms']:9.3f}  p99 {r['p99_ms']:9.3f} ms"
+              f"  | {r['throughput']:10.1f}/s")
+
+    if "detect" in stages:
+        from utils.model_registry import create_detector
+        detector = create_detector()
+        record("detect", measure(detector.detect, frames, repeat))
+    if "align" in stages:
+        pairs = list(zip(frames, faces))
+        record("align_box", measure(lambda p: align_face(p[0], p[1][0], None, padding, "box"), pairs, repeat))
+        record("align_landmarks", measure(lambda p: align_face(p[0], p[1][0], p[1][1], padding), pairs, repeat))
+    if {"preprocess", "embed", "embed_batch"} & set(stages):
+        from utils.model_registry import get_embedder
+        embedder = get_embedder()
+        if "preprocess" in stages:
+            buf = np.empty((BATCH, 3, 112, 112), dtype=np.float32)
+            batch = [crops[i % len(crops)] for i in range(BATCH)]
+            record("preprocess_batch", measure(lambda b: embedder._preprocess_into(b, buf), [batch], repeat),
+                   items=BATCH)
+        if "embed" in stages:
+            record("embed", measure(embedder.get, crops, repeat))
+        if "embed_batch" in stages:
+            batch = [crops[i % len(crops)] for i in range(BATCH)]
+            record(f"embed_batch{BATCH}", measure(embedder.get_batch, [batch], max(repeat // 4, 10)),
+                   items=BATCH)
+    if "liveness" in stages:
+        from services.verify import detect_liveness
+        record("liveness", measure(detect_liveness, crops, repeat))
+    if "match" in stages:
+        dim = config.get("face_recognition", "embedding_size", 512)
+        queries = list(rng.standard_normal((64, dim), dtype=np.float32))
+        queries = [q / np.linalg.norm(q) for q in queries]
+        for size in sizes:
+            gallery = gallery_for(size, dim, rng)
+            label = f"{size // 1000}k" if size % 1000 == 0 else str(size)
+            record(f"match_{label}", measure(lambda q: gallery.match(q, top_k=1), queries, repeat))
+    return results
+
+
+def environment():
+    import onnxruntime
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": onnxruntime.__version__,
+        "detector_backend": config.get("face_detection", "backend", "ultralytics"),
+        "alignment": config.get("face_recognition", "alignment", "landmarks"),
+        "gallery_precision": (config.get("gallery", "quantization") or {}).get("precision", "float32"),
+        "ann": bool((config.get("gallery", "ann") or {}).get("enabled", False)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Bước có p50 chậm hơn baseline quá tolerance (tỉ lệ) → regression."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        ratio = r["p50_ms"] / max(base["p50_ms"], 1e-6)
+        flag = "CHẬM" if ratio > 1 + tolerance else "OK  "
+        print(f"{flag} {name:22s} p50 {base['p50_ms']:9.3f} → {r['p50_ms']:9.3f} ms ({ratio:5.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các bước của pipeline nhận diện")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"chọn trong {', '.join(STAGES)}")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="số embedding của gallery tổng hợp")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="ghi kết quả làm baseline")
+    parser.add_argument("--compare", action="store_true", help="so với baseline, mã lỗi 1 nếu chậm hơn")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="cho phép p50 chậm hơn baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"stage không hỗ trợ: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    env = environment()
+    print(f"Môi trường: {env}")
+    results = run(stages, sizes, args.repeat, args.seed)
+    report = {"environment": env, "repeat": args.repeat, "seed": args.seed, "results": results}
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi baseline → {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"Chưa có baseline {args.baseline} (chạy --save trước)")
+            sys.exit(2)
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        changed = {k: (v, env.get(k)) for k, v in baseline.get("environment", {}).items() if env.get(k) != v}
+        if changed:
+            print(f"Cảnh báo: môi trường khác baseline {changed}")
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"{len(regressions)} bước chậm hơn baseline > {args.tolerance:.0%}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# tools/check_detector_parity.py
+"""
+So sánh backend detect onnx với ultralytics trên 1 bộ ảnh cố định (mặc định data/test).
+Trả về mã lỗi 1 nếu lệch quá ngưỡng → dùng được trong CI / trước khi đổi backend.
+
+    python tools/check_detector_parity.py
+    python tools/check_detector_parity.py --images data/test --min-iou 0.9 --max-conf-diff 0.02
+"""
+import argparse
+import glob
+import os
+import sys
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.model_registry import create_detector
+
+
+def box_iou(a, b):
+    """IoU giữa 2 tập box (N×4, M×4)."""
+    a, b = np.asarray(a, dtype=np.float32)[:, :4], np.asarray(b, dtype=np.float32)[:, :4]
+    iw = np.clip(np.minimum(a[:, None, 2], b[:, 2]) - np.maximum(a[:, None, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, None, 3], b[:, 3]) - np.maximum(a[:, None, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b - inter + 1e-9)
+
+
+def compare(ref, test):
+    """Ghép box theo IoU lớn nhất; trả về (số box thiếu/thừa, IoU nhỏ nhất, lệch conf lớn nhất)."""
+    if len(ref) == 0 or len(test) == 0:
+        return abs(len(ref) - len(test)), 1.0, 0.0
+    iou = box_iou(ref, test)
+    best = iou.argmax(axis=1)
+    ious = iou[np.arange(len(ref)), best]
+    conf_diff = np.abs(ref[:, 4] - test[best, 4])
+    return abs(len(ref) - len(test)), float(ious.min()), float(conf_diff.max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra backend onnx khớp ultralytics")
+    parser.add_argument("--images", default="data/test")
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--max-conf-diff", type=float, default=0.02)
+    args = parser.parse_args()
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+    if not paths:
+        print(f"Không có ảnh trong {args.images}")
+        sys.exit(2)
+
+    ref_det = create_detector("ultralytics")
+    onnx_det = create_detector("onnx")
+    failed = 0
+    for path in paths:
+        img = cv2.imread(path)
+        ref, test = ref_det.detect(img), onnx_det.detect(img)
+        count_diff, min_iou, conf_diff = compare(ref, test)
+        ok = count_diff == 0 and min_iou >= args.min_iou and conf_diff <= args.max_conf_diff
+        failed += not ok
+        print(f"{'OK  ' if ok else 'LỆCH'} {os.path.basename(path)}: {len(ref)} vs {len(test)} box, "
+              f"IoU min {min_iou:.3f}, lệch conf {conf_diff:.3f}")
+    print(f"{len(paths) - failed}/{len(paths)} ảnh khớp")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# tools/export_yolo_onnx.py
+"""
+Export YOLOv8-face (.pt) sang ONNX cho face_detection.backend = onnx (cần ultralytics + torch, chạy 1 lần).
+
+    python tools/export_yolo_onnx.py
+    python tools/export_yolo_onnx.py --weights models/yolov8n-face-lindevs.pt --imgsz 640
+"""
+import argparse
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export YOLOv8-face sang ONNX")
+    parser.add_argument("--weights", default=config.get("models", "yoloface", "models/yolov8n-face-lindevs.pt"))
+    parser.add_argument("--output", default=config.get("models", "yoloface_onnx", "models/yolov8n-face-lindevs.onnx"))
+    parser.add_argument("--imgsz", type=int, default=config.get("face_detection", "imgsz", 640))
+    parser.add_argument("--opset", type=int, default=12)
+    parser.add_argument("--static", action="store_true", help="batch cố định 1 (mặc định: batch động)")
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    exported = YOLO(config.resolve_path(args.weights)).export(
+        format="onnx", imgsz=args.imgsz, opset=args.opset, dynamic=not args.static, simplify=True)
+    output = config.resolve_path(args.output)
+    if os.path.abspath(exported) != os.path.abspath(output):
+        shutil.move(exported, output)
+    print(f"Đã export: {output}")
+
+
+if __name__ == "__main__":
+    main()
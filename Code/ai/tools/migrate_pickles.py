@@ -0,0 +1,35 @@
+# tools/migrate_pickles.py
+"""
+Chuyển gallery cũ (data/users/*.pkl) sang định dạng cột data/gallery/.
+
+    python tools/migrate_pickles.py
+    python tools/migrate_pickles.py --data-dir data/users --gallery-dir data/gallery
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from gallery.face_gallery import DATA_DIR, GALLERY_DIR, FaceGallery, migrate_pickles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển data/users/*.pkl sang data/gallery")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--gallery-dir", default=GALLERY_DIR)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    migrated = migrate_pickles(args.data_dir, args.gallery_dir)
+    print(f"Đã chuyển {migrated} user trong {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    t0 = time.perf_counter()
+    gallery = FaceGallery.open(args.gallery_dir, legacy_dir=None)
+    print(f"Gallery: {len(gallery)} user, {gallery.num_embeddings} embedding, "
+          f"mở trong {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
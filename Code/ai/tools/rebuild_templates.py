@@ -0,0 +1,31 @@
+# tools/rebuild_templates.py
+"""
+Tính lại template so khớp của mọi user từ shot gốc (sau khi đổi gallery.templates trong config.yaml).
+
+    python tools/rebuild_templates.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from gallery.face_gallery import GALLERY_DIR, FaceGallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tính lại template từ data/gallery/shots")
+    parser.add_argument("--gallery-dir", default=GALLERY_DIR)
+    args = parser.parse_args()
+
+    gallery = FaceGallery.from_config(args.gallery_dir)
+    before = gallery.num_embeddings
+    t0 = time.perf_counter()
+    count = gallery.rebuild_templates()
+    print(f"Đã tính lại {count} user trong {(time.perf_counter() - t0):.1f} s: "
+          f"{before} → {gallery.num_embeddings} hàng so khớp")
+
+
+if __name__ == "__main__":
+    main()
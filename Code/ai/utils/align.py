@@ -0,0 +1,76 @@
+# utils/align.py
+import cv2
+import numpy as np
+
+ALIGN_MODES = ("landmarks", "box")
+ARCFACE_SIZE = 112
+
+# Vị trí chuẩn 5 điểm (mắt trái, mắt phải, mũi, khóe miệng trái, khóe miệng phải) trên ảnh 112x112 của ArcFace
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+
+def similarity_matrix(src, dst=ARCFACE_TEMPLATE):
+    """
+    Ma trận 2x3 của phép đồng dạng (xoay + tỉ lệ đều + tịnh tiến) đưa src gần dst nhất
+    theo bình phương tối thiểu (Umeyama). src, dst: (5, 2).
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_c, dst_c = src - src_mean, dst - dst_mean
+    u, s, vt = np.linalg.svd(dst_c.T @ src_c / len(src))
+    d = np.array([1.0, np.sign(np.linalg.det(u) * np.linalg.det(vt)) or 1.0])
+    rot = u @ np.diag(d) @ vt
+    var = (src_c ** 2).sum() / len(src)
+    scale = (s * d).sum() / var if var > 0 else 1.0
+    m = np.empty((2, 3), dtype=np.float64)
+    m[:, :2] = scale * rot
+    m[:, 2] = dst_mean - scale * rot @ src_mean
+    return m
+
+
+def box_region(frame_shape, box, padding_ratio=0.4):
+    """Vùng crop rộng quanh box (mode "box"): thêm tóc/cổ, giới hạn trong khung hình."""
+    h, w = frame_shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in box[:4])
+    pad_h = int((y2 - y1) * padding_ratio)
+    pad_w = int((x2 - x1) * (padding_ratio * 0.75))
+    return (max(0, x1 - pad_w), max(0, y1 - int(pad_h * 1.2)),
+            min(w, x2 + pad_w), min(h, y2 + int(pad_h * 0.8)))
+
+
+def box_matrix(region, size=ARCFACE_SIZE):
+    """
+    Ma trận 2x3 từ vùng crop (tọa độ trong vùng) → ảnh size x size, gộp 2 bước cũ
+    (resize vùng về size, thêm viền 30%/20% rồi resize lại) thành 1 phép biến đổi.
+    """
+    x1, y1, x2, y2 = region
+    border_h, border_w = int(size * 0.3), int(size * 0.2)
+    sx, sy = size / max(x2 - x1, 1), size / max(y2 - y1, 1)
+    fx, fy = size / (size + 2 * border_w), size / (size + 2 * border_h)
+    # Quy ước tâm pixel của cv2.resize: x_dst = (x_src + 0.5) * s - 0.5
+    return np.array([
+        [sx * fx, 0.0, (0.5 * sx + border_w) * fx - 0.5],
+        [0.0, sy * fy, (0.5 * sy + border_h) * fy - 0.5],
+    ])
+
+
+def align_face(frame, box, kpts=None, padding_ratio=0.4, mode="landmarks", size=ARCFACE_SIZE):
+    """
+    Ảnh đầu vào ArcFace (size x size) bằng đúng 1 lần warpAffine:
+    - mode landmarks + có kpts (5x2): đồng dạng 5 điểm về ARCFACE_TEMPLATE (mặt thẳng, mắt cố định)
+    - còn lại: crop rộng theo box + viền nhân bản như cách cũ (không căn chỉnh)
+    """
+    if mode == "landmarks" and kpts is not None:
+        m = similarity_matrix(kpts) * (size / ARCFACE_SIZE)
+        return cv2.warpAffine(frame, m, (size, size), flags=cv2.INTER_LINEAR, borderValue=0)
+    x1, y1, x2, y2 = region = box_region(frame.shape, box, padding_ratio)
+    # Warp trên view của vùng crop (không copy) → BORDER_REPLICATE nhân bản đúng mép vùng như copyMakeBorder
+    return cv2.warpAffine(frame[y1:y2, x1:x2], box_matrix(region, size), (size, size),
+                          flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
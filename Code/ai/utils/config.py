@@ -0,0 +1,46 @@
+# utils/config.py
+import os
+import yaml
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.environ.get("FACE_API_CONFIG", os.path.join(ROOT_DIR, "config.yaml"))
+
+_config = None
+
+
+def load_config(path=None):
+    """Đọc config.yaml (cache trong process). Đặt FACE_API_CONFIG để dùng file khác."""
+    global _config
+    if path is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    if _config is None:
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                _config = yaml.safe_load(f) or {}
+        else:
+            print(f"[CONFIG] Không thấy {CONFIG_PATH}, dùng giá trị mặc định")
+            _config = {}
+    return _config
+
+
+def get(section, key, default=None):
+    """Lấy config[section][key], trả về default nếu thiếu."""
+    return (load_config().get(section) or {}).get(key, default)
+
+
+def section(name):
+    """Cả 1 section của config (dict rỗng nếu thiếu)."""
+    return dict(load_config().get(name) or {})
+
+
+def override(section, key, value):
+    """Ghi đè 1 giá trị cho process hiện tại (không ghi file), vd. số thread của worker con."""
+    load_config().setdefault(section, {})[key] = value
+
+
+def resolve_path(path):
+    """Đường dẫn tương đối trong config tính từ thư mục gốc (Code/ai)."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(ROOT_DIR, path)
@@ -0,0 +1,53 @@
+# utils/executor.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ServerBusy(Exception):
+    """Hàng đợi xử lý đã đầy → API trả 503 để thiết bị thử lại sau."""
+
+
+class BoundedExecutor:
+    """
+    Thread pool cho phần việc nặng CPU (decode, crop, liveness, vẽ, ghi ảnh).
+    Tối đa workers job chạy + max_pending job chờ; vượt quá thì ném ServerBusy
+    ngay thay vì xếp hàng vô hạn.
+    """
+
+    def __init__(self, workers=4, max_pending=32):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServerBusy("Server đang quá tải, thử lại sau")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,95 @@
+# utils/image_io.py
+import struct
+import time
+import cv2
+import numpy as np
+
+from utils.align import align_face
+
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def decode_image(contents):
+    """Bytes JPG/PNG → ảnh BGR (None nếu không đọc được)."""
+    nparr = np.frombuffer(contents, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+def jpeg_size(contents):
+    """(w, h) đọc từ header JPEG (marker SOF) mà không decode; None nếu không phải JPEG."""
+    if contents[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(contents)
+    while i + 9 < n:
+        if contents[i] != 0xFF:
+            i += 1
+            continue
+        marker = contents[i + 1]
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 1 if marker == 0xFF else 2
+            continue
+        if marker in _SOF_MARKERS:
+            h, w = struct.unpack(">HH", contents[i + 5:i + 9])
+            return w, h
+        i += 2 + struct.unpack(">H", contents[i + 2:i + 4])[0]
+    return None
+
+
+class DecodedImage:
+    """
+    Ảnh upload đã decode cho detect:
+    - image : ảnh BGR (JPEG lớn được decode giảm scale = 2/4/8 lần ngay lúc decode)
+    - full  : ảnh đầy đủ, chỉ decode khi thực sự cần crop ở độ phân giải gốc
+    Tọa độ box từ detect nằm trong hệ của image; to_full() đổi sang ảnh gốc.
+    """
+
+    __slots__ = ("contents", "image", "scale", "decode_ms", "_full")
+
+    def __init__(self, contents, image, scale=1, decode_ms=0.0):
+        self.contents = contents
+        self.image = image
+        self.scale = scale
+        self.decode_ms = decode_ms
+        self._full = image if scale == 1 else None
+
+    @property
+    def full(self):
+        if self._full is None:
+            t0 = time.perf_counter()
+            self._full = decode_image(self.contents)
+            self.decode_ms += (time.perf_counter() - t0) * 1000
+        return self._full
+
+    def to_full(self, face):
+        """Box [x1, y1, x2, y2, ...] trong image → tọa độ ảnh gốc."""
+        return [int(v * self.scale) for v in face[:4]] + list(face[4:])
+
+    def crop(self, face, padding_ratio=0.4, min_side=112, kpts=None, mode="landmarks"):
+        """
+        Ảnh 112x112 cho ArcFace (xem align_face; kpts 5x2 cùng hệ tọa độ với face).
+        Mặt trong ảnh đã giảm vẫn ≥ min_side px thì warp luôn (về 112 cũng không mất chi tiết);
+        mặt nhỏ hơn thì warp lại từ ảnh gốc.
+        """
+        x1, y1, x2, y2 = face[:4]
+        if self.scale == 1 or min(x2 - x1, y2 - y1) >= min_side:
+            return align_face(self.image, face, kpts, padding_ratio, mode)
+        full_kpts = None if kpts is None else np.asarray(kpts, dtype=np.float32) * self.scale
+        return align_face(self.full, self.to_full(face), full_kpts, padding_ratio, mode)
+
+
+def decode_for_detection(contents, detect_side=960):
+    """
+    Decode bytes upload cho detect: JPEG có cạnh dài ≥ 2×detect_side được decode giảm
+    2/4/8 lần (IMREAD_REDUCED_*, nhanh hơn và ít RAM hơn decode đầy đủ rồi resize).
+    Trả về DecodedImage, None nếu không đọc được.
+    """
+    t0 = time.perf_counter()
+    scale = 1
+    size = jpeg_size(contents) if detect_side else None
+    if size:
+        scale = next((f for f in (8, 4, 2) if max(size) / f >= detect_side), 1)
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), REDUCED_FLAGS.get(scale, cv2.IMREAD_COLOR))
+    if image is None:
+        return None
+    return DecodedImage(contents, image, scale, (time.perf_counter() - t0) * 1000)
@@ -0,0 +1,159 @@
+# utils/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket thời gian (giây) cho các bước xử lý: từ 0.5 ms (crop, liveness) tới vài giây (ảnh lớn lúc quá tải)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FACE_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(v):
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Giá trị đọc lúc scrape qua hàm fn() (vd. số user trong gallery)."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return self.header() + [f"{self.name} {_num(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, ([*c], s, n)) for k, (c, s, n) in self._values.items())
+        lines = self.header()
+        names = self.label_names + ("le",)
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_num(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    "face_api_stage_seconds", "Thời gian từng bước xử lý verify (giây)", labels=("stage",)))
+REQUESTS = REGISTRY.add(Counter(
+    "face_api_verify_requests_total", "Số request verify theo kết quả", labels=("status",)))
+FACES_PER_REQUEST = REGISTRY.add(Histogram(
+    "face_api_faces_per_request", "Số khuôn mặt detect được trong 1 ảnh verify", buckets=FACE_BUCKETS))
+FACES = REGISTRY.add(Counter(
+    "face_api_faces_total", "Số khuôn mặt verify theo kết quả (success | unknown | fake)", labels=("result",)))
+STREAM_SESSIONS = REGISTRY.add(Counter(
+    "face_api_stream_sessions_total", "Số phiên /verify/stream theo quyết định", labels=("status",)))
+STREAM_FRAMES = REGISTRY.add(Histogram(
+    "face_api_stream_frames", "Số frame nhận trước khi phiên /verify/stream ra quyết định",
+    buckets=(1, 2, 3, 5, 8, 13, 20)))
+RESULT_CACHE = REGISTRY.add(Counter(
+    "face_api_result_cache_total", "Tra cứu cache kết quả theo nội dung ảnh (verify | face)",
+    labels=("kind", "result")))
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+@contextmanager
+def timer(stage):
+    """with timer("detect"): ... → ghi thời gian vào face_api_stage_seconds{stage="detect"}."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - t0, stage)
+
+
+def register_gauge(name, help, fn):
+    """Gauge đọc lúc scrape (gọi 1 lần lúc khởi tạo module, vd. kích thước gallery)."""
+    return REGISTRY.add(Gauge(name, help, fn))
+
+
+def render():
+    """Toàn bộ metric ở định dạng text của Prometheus (exposition format 0.0.4)."""
+    return REGISTRY.render()
@@ -0,0 +1,198 @@
+# utils/model_registry.py
+import os
+import threading
+import time
+import numpy as np
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import config
+
+_lock = threading.RLock()
+_models = {}
+_stats = {}
+_warmup_ms = None
+
+
+def _rss_mb():
+    """RSS hiện tại của process (MB), None nếu không đo được."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _load(name, factory):
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _models:
+            rss_before = _rss_mb()
+            t0 = time.perf_counter()
+            _models[name] = factory()
+            load_ms = (time.perf_counter() - t0) * 1000
+            rss_after = _rss_mb()
+            _stats[name] = {
+                "load_time_ms": round(load_ms, 1),
+                "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+            }
+            print(f"[REGISTRY] {name} loaded in {load_ms:.0f} ms")
+        return _models[name]
+
+
+def get_detector():
+    """YOLOFace dùng chung cho cả process (tạo khi gọi lần đầu)."""
+    return _load("detector", create_detector)
+
+
+def create_detector(backend=None):
+    """face_detection.backend: ultralytics (file .pt, cần torch) | onnx (chỉ cần onnxruntime)."""
+    backend = backend or config.get("face_detection", "backend", "ultralytics")
+    conf = config.get("face_detection", "confidence_threshold", 0.5)
+    min_size = config.get("face_detection", "min_face_size", 0)
+    max_faces = config.get("face_detection", "max_faces", 0)
+    if backend == "onnx":
+        from detector.yolo_face_onnx import YOLOFaceONNX
+        return YOLOFaceONNX(
+            config.resolve_path(config.get("models", "yoloface_onnx", "models/yolov8n-face-lindevs.onnx")),
+            conf_threshold=conf,
+            iou_threshold=config.get("face_detection", "iou_threshold", 0.7),
+            imgsz=config.get("face_detection", "imgsz", 640),
+            min_size=min_size,
+            max_faces=max_faces,
+            ort_options=ort_options(),
+        )
+    if backend != "ultralytics":
+        raise ValueError(f"face_detection.backend không hỗ trợ: {backend}")
+    from detector.yolo_face import YOLOFace
+    return YOLOFace(
+        config.resolve_path(config.get("models", "yoloface", "models/yolov8n-face-lindevs.pt")),
+        conf_threshold=conf,
+        min_size=min_size,
+        max_faces=max_faces,
+    )
+
+
+def get_embedder():
+    """ArcFace dùng chung cho cả process (tạo khi gọi lần đầu)."""
+    from embedder.arcface import ArcFace
+    return _load("embedder", lambda: ArcFace(
+        config.resolve_path(config.get("models", "arcface", "models/w600k_r50.onnx")),
+        max_batch=config.get("face_recognition", "max_batch", 32),
+        ort_options=ort_options(),
+    ))
+
+
+def ort_options():
+    """Section onnxruntime trong config (đường dẫn cache tính từ thư mục gốc)."""
+    opts = config.section("onnxruntime")
+    if opts.get("optimized_model_dir"):
+        opts["optimized_model_dir"] = config.resolve_path(opts["optimized_model_dir"])
+    return opts
+
+
+def get_scheduler():
+    """
+    Scheduler gom lô detect/embed giữa các request (1 thread suy luận/process).
+    worker_pool.enabled → WorkerPool: model nằm trong N process worker, process này không nạp model.
+    """
+    if worker_pool_enabled():
+        from utils.worker_pool import WorkerPool
+        return _load("scheduler", lambda: WorkerPool(
+            workers=config.get("worker_pool", "workers", 2),
+            cpu_affinity=config.get("worker_pool", "cpu_affinity", "auto"),
+            slots=config.get("worker_pool", "slots", 8),
+            slot_mb=config.get("worker_pool", "slot_mb", 4),
+            max_batch=config.get("scheduler", "max_batch", 16),
+            max_wait_ms=config.get("scheduler", "max_wait_ms", 8),
+            max_queue=config.get("scheduler", "max_queue", 64),
+            job_timeout_s=config.get("worker_pool", "job_timeout_s", 30),
+        ))
+    from utils.scheduler import InferenceScheduler
+    return _load("scheduler", lambda: InferenceScheduler(
+        get_detector(),
+        get_embedder(),
+        max_batch=config.get("scheduler", "max_batch", 16),
+        max_wait_ms=config.get("scheduler", "max_wait_ms", 8),
+        max_queue=config.get("scheduler", "max_queue", 64),
+    ))
+
+
+def worker_pool_enabled():
+    return bool(config.get("worker_pool", "enabled", False))
+
+
+def get_executor():
+    """Thread pool giới hạn cho decode/crop/vẽ/ghi ảnh (trả 503 khi đầy)."""
+    from utils.executor import BoundedExecutor
+    return _load("executor", lambda: BoundedExecutor(
+        workers=config.get("executor", "workers", 4),
+        max_pending=config.get("executor", "max_pending", 32),
+    ))
+
+
+def get_result_writer():
+    """Thread nền vẽ + ghi ảnh kết quả verify (bỏ ảnh khi hàng đợi đầy, giới hạn dung lượng)."""
+    from utils.result_writer import ResultWriter
+    return _load("result_writer", lambda: ResultWriter(
+        config.get("output", "verify_dir", "output/verify"),
+        mode=config.get("output", "save", "failures"),
+        sample_rate=config.get("output", "sample_rate", 0.0),
+        max_queue=config.get("output", "max_queue", 16),
+        max_mb=config.get("output", "max_mb", 500),
+        max_files=config.get("output", "max_files", 5000),
+    ))
+
+
+def get_result_cache():
+    """Cache LRU/TTL kết quả theo hash nội dung ảnh upload (retry, gửi lại ảnh đã embed)."""
+    from utils.result_cache import ResultCache
+    return _load("result_cache", lambda: ResultCache(
+        max_entries=config.get("result_cache", "max_entries", 1024),
+        max_mb=config.get("result_cache", "max_mb", 64),
+        ttl_s=config.get("result_cache", "ttl_s", 300),
+    ))
+
+
+def warmup():
+    """Nạp model + chạy 1 lần suy luận giả để lần request đầu không bị chậm."""
+    global _warmup_ms
+    if worker_pool_enabled():
+        # Worker tự nạp + chạy thử model; get_scheduler chờ tất cả worker sẵn sàng
+        t0 = time.perf_counter()
+    else:
+        detector = get_detector()
+        embedder = get_embedder()
+        t0 = time.perf_counter()
+        detector.detect(np.zeros((240, 320, 3), dtype=np.uint8))
+        embedder.get(np.zeros((112, 112, 3), dtype=np.uint8))
+    get_scheduler()
+    get_executor()
+    get_result_writer()
+    get_result_cache()
+    _warmup_ms = round((time.perf_counter() - t0) * 1000, 1)
+    print(f"[REGISTRY] warmup done in {_warmup_ms:.0f} ms")
+
+
+def stats():
+    """Thời gian nạp, bộ nhớ tăng thêm của từng model, RSS hiện tại và thống kê gom lô."""
+    rss = _rss_mb()
+    info = {
+        "loaded": sorted(_models),
+        "models": dict(_stats),
+        "warmup_ms": _warmup_ms,
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "pid": os.getpid(),
+    }
+    for name in ("scheduler", "executor", "result_writer", "result_cache"):
+        if name in _models:
+            info[name] = _models[name].stats()
+    return info
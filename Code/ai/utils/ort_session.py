@@ -0,0 +1,70 @@
+# utils/ort_session.py
+import hashlib
+import os
+import onnxruntime as ort
+
+ORT_DEFAULTS = {
+    "intra_op_threads": 0,          # 0 = ORT tự chọn (= số core); nhiều worker → chia core cho từng worker
+    "inter_op_threads": 0,          # chỉ dùng khi execution_mode = parallel
+    "execution_mode": "sequential",  # sequential | parallel
+    "graph_optimization": "all",    # disable | basic | extended | all
+    "cpu_mem_arena": True,
+    "mem_pattern": True,
+    "allow_spinning": True,         # False: thread ORT ngủ ngay khi rảnh (nên tắt khi chạy nhiều worker)
+    "optimized_model_dir": "",      # thư mục cache model đã tối ưu ("" = không cache)
+    "io_binding": True,             # bind buffer input/output cấp sẵn thay cho session.run
+}
+
+_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+_EXEC_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def session_options(opts):
+    """dict cấu hình (xem ORT_DEFAULTS) → ort.SessionOptions."""
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = int(opts["intra_op_threads"])
+    so.inter_op_num_threads = int(opts["inter_op_threads"])
+    so.execution_mode = _EXEC_MODES[opts["execution_mode"]]
+    so.graph_optimization_level = _OPT_LEVELS[opts["graph_optimization"]]
+    so.enable_cpu_mem_arena = bool(opts["cpu_mem_arena"])
+    so.enable_mem_pattern = bool(opts["mem_pattern"])
+    so.add_session_config_entry("session.intra_op.allow_spinning", "1" if opts["allow_spinning"] else "0")
+    so.add_session_config_entry("session.inter_op.allow_spinning", "1" if opts["allow_spinning"] else "0")
+    return so
+
+
+def _cache_path(model_path, opts):
+    """File model đã tối ưu, gắn với model gốc + mức tối ưu + phiên bản ORT (có thể phụ thuộc CPU)."""
+    st = os.stat(model_path)
+    key = f"{os.path.abspath(model_path)}|{st.st_size}|{st.st_mtime_ns}|{opts['graph_optimization']}|{ort.__version__}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(opts["optimized_model_dir"], f"{name}.{digest}.onnx")
+
+
+def create_session(model_path, opts=None, providers=("CPUExecutionProvider",)):
+    """
+    Tạo InferenceSession theo cấu hình. Nếu có optimized_model_dir: lần đầu ORT ghi model
+    đã tối ưu vào cache, các lần sau nạp thẳng file đó (bỏ bước tối ưu đồ thị lúc khởi động).
+    """
+    opts = dict(ORT_DEFAULTS, **(opts or {}))
+    so = session_options(opts)
+    if opts["optimized_model_dir"] and opts["graph_optimization"] != "disable":
+        cached = _cache_path(model_path, opts)
+        if os.path.exists(cached):
+            cached_so = session_options(dict(opts, graph_optimization="disable"))
+            try:
+                return ort.InferenceSession(cached, sess_options=cached_so, providers=list(providers))
+            except Exception as e:
+                print(f"[ORT] Cache {cached} lỗi ({e}), tối ưu lại")
+        os.makedirs(opts["optimized_model_dir"], exist_ok=True)
+        so.optimized_model_filepath = cached
+    return ort.InferenceSession(model_path, sess_options=so, providers=list(providers))
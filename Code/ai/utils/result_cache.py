@@ -0,0 +1,102 @@
+# utils/result_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from utils import metrics
+
+MISS = object()
+
+
+def content_key(kind, contents, *extra):
+    """
+    Khóa cache theo nội dung ảnh upload (blake2b 128 bit, ~GB/s) + tham số ảnh hưởng kết quả
+    (vd. gallery version, accs). Cùng bytes JPEG gửi lại → cùng khóa.
+    """
+    h = hashlib.blake2b(contents, digest_size=16)
+    for value in extra:
+        h.update(b"\0" + repr(value).encode())
+    return kind, h.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache LRU + TTL kết quả xử lý ảnh trong process (thiết bị retry, backend gửi lại ảnh đã embed):
+    - Khóa (kind, hash nội dung): "verify" = response /verify (khóa gồm gallery version + accs),
+      "face" = mặt chính của 1 ảnh (bbox, det_score, crop, embedding) dùng cho /extract-embedding + register
+    - Giới hạn max_entries và tổng dung lượng max_mb (ước lượng theo nbytes lúc put): vượt → bỏ mục cũ nhất
+    - Mục quá ttl_s coi như miss; max_entries: 0 → tắt cache
+    - Đếm hit/miss theo kind (hiện ở /models và /metrics)
+    """
+
+    def __init__(self, max_entries=1024, max_mb=64, ttl_s=300):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_s = ttl_s
+        self.bytes = 0
+        self.evicted = 0
+        self._hits = {}
+        self._misses = {}
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key → (hết hạn lúc, nbytes, value)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """Giá trị đã cache hoặc MISS (giá trị cache có thể là None, vd. ảnh không có mặt)."""
+        if not self.enabled:
+            return MISS
+        kind = key[0]
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._misses[kind] = self._misses.get(kind, 0) + 1
+            else:
+                self._items.move_to_end(key)
+                self._hits[kind] = self._hits.get(kind, 0) + 1
+        metrics.RESULT_CACHE.inc(kind, "miss" if entry is None else "hit")
+        return MISS if entry is None else entry[2]
+
+    def put(self, key, value, nbytes=0):
+        if not self.enabled or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (time.monotonic() + self.ttl_s, nbytes, value)
+            self.bytes += nbytes
+            while len(self._items) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._items)))
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def _drop(self, key):
+        _, nbytes, _ = self._items.pop(key)
+        self.bytes -= nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            kinds = sorted(set(self._hits) | set(self._misses))
+            return {
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "mb": round(self.bytes / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "ttl_s": self.ttl_s,
+                "evicted": self.evicted,
+                "hits": {k: self._hits.get(k, 0) for k in kinds},
+                "misses": {k: self._misses.get(k, 0) for k in kinds},
+            }
@@ -0,0 +1,145 @@
+# utils/result_writer.py
+import atexit
+import itertools
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+
+from utils import metrics
+
+SAVE_MODES = ("all", "failures", "none")
+
+
+class ResultWriter:
+    """
+    Vẽ + ghi ảnh kết quả trên 1 thread nền, không nằm trên đường xử lý request.
+    - Hàng đợi giới hạn max_queue: đầy thì bỏ ảnh (đếm dropped), không chặn request
+    - Tên file duy nhất (micro giây + pid + bộ đếm) → request đồng thời không ghi đè nhau
+    - Giữ tổng dung lượng ≤ max_mb và số file ≤ max_files: xóa ảnh cũ nhất trước
+    - should_save: chế độ "all" / "failures" (chỉ lưu ca thất bại/giả mạo) / "none",
+      cộng thêm sample_rate ca thành công được lưu ngẫu nhiên
+    """
+
+    def __init__(self, output_dir, mode="failures", sample_rate=0.0, max_queue=16,
+                 max_mb=500, max_files=5000):
+        if mode not in SAVE_MODES:
+            raise ValueError(f"output.save phải là {', '.join(SAVE_MODES)}")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_files = max_files
+        self.written = 0
+        self.dropped = 0
+        self.deleted = 0
+        self._counter = itertools.count()
+        self._queue = queue.Queue(maxsize=max_queue)
+        os.makedirs(output_dir, exist_ok=True)
+        self._files, self._bytes = self._scan()
+        self._thread = threading.Thread(target=self._loop, name="result-writer", daemon=True)
+        self._thread.start()
+        # Chờ ghi xong ảnh đang xếp hàng trước khi process thoát (tránh dừng giữa lúc OpenCV đang ghi)
+        atexit.register(self.close)
+
+    def _scan(self):
+        """Ảnh đã có trên đĩa (cũ → mới) để áp dụng giới hạn ngay từ đầu."""
+        files = []
+        for name in os.listdir(self.output_dir):
+            path = os.path.join(self.output_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                files.append((st.st_mtime, path, st.st_size))
+        files.sort()
+        return deque((path, size) for _, path, size in files), sum(size for _, _, size in files)
+
+    def should_save(self, failed, requested=None):
+        """requested=True/False (tham số request) ghi đè chính sách trong config."""
+        if requested is not None:
+            return bool(requested)
+        if self.mode == "all":
+            return True
+        if self.mode == "failures" and failed:
+            return True
+        return self.mode != "none" and random.random() < self.sample_rate
+
+    def submit(self, frame, render=None, *args, prefix="verify"):
+        """
+        Xếp ảnh vào hàng đợi; render(frame, *args) chạy trên thread nền trước khi ghi.
+        Trả về đường dẫn sẽ ghi, None nếu hàng đợi đầy. Không sửa frame sau khi submit.
+        """
+        filename = os.path.join(
+            self.output_dir,
+            f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{next(self._counter)}.jpg")
+        try:
+            self._queue.put_nowait((filename, frame, render, args))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return filename
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            filename, frame, render, args = item
+            t0 = time.perf_counter()
+            try:
+                if render is not None:
+                    render(frame, *args)
+                if cv2.imwrite(filename, frame):
+                    self.written += 1
+                    self._files.append((filename, os.path.getsize(filename)))
+                    self._bytes += self._files[-1][1]
+                    self._enforce_quota()
+                metrics.observe("result_write", time.perf_counter() - t0)
+            except Exception as e:
+                print(f"[WRITER] Lỗi ghi {filename}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _enforce_quota(self):
+        while self._files and (self._bytes > self.max_bytes or len(self._files) > self.max_files):
+            path, size = self._files.popleft()
+            self._bytes -= size
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except OSError:
+                pass
+
+    def flush(self):
+        """Chờ ghi hết ảnh đang xếp hàng (dùng khi tắt server / test)."""
+        self._queue.join()
+
+    def close(self, timeout=5.0):
+        """Ghi nốt hàng đợi rồi dừng thread ghi."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "deleted": self.deleted,
+            "files": len(self._files),
+            "disk_mb": round(self._bytes / (1024 * 1024), 1),
+        }
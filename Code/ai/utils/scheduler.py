@@ -0,0 +1,155 @@
+# utils/scheduler.py
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils.executor import ServerBusy
+
+
+class _Job:
+    __slots__ = ("kind", "payload", "future", "enqueued_at")
+
+    def __init__(self, kind, payload):
+        self.kind = kind
+        self.payload = payload
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class _BatchStats:
+    """Thống kê kích thước lô và thời gian chờ trong hàng đợi cho 1 loại job."""
+
+    def __init__(self):
+        self.batches = 0
+        self.jobs = 0
+        self.items = 0
+        self.max_batch = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+
+    def record(self, jobs, size, run_ms, started_at):
+        waits = [(started_at - j.enqueued_at) * 1000 for j in jobs]
+        self.batches += 1
+        self.jobs += len(jobs)
+        self.items += size
+        self.max_batch = max(self.max_batch, size)
+        self.wait_ms_total += sum(waits)
+        self.wait_ms_max = max(self.wait_ms_max, max(waits))
+        self.run_ms_total += run_ms
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0,
+            "max_batch": self.max_batch,
+            "avg_wait_ms": round(self.wait_ms_total / self.jobs, 2) if self.jobs else 0,
+            "max_wait_ms": round(self.wait_ms_max, 2),
+            "avg_run_ms": round(self.run_ms_total / self.batches, 2) if self.batches else 0,
+        }
+
+
+class InferenceScheduler:
+    """
+    Gom job detect/embed từ nhiều request đồng thời thành lô.
+    - Job đầu tiên mở 1 cửa sổ max_wait_ms; mọi job tới trong cửa sổ (tối đa max_batch) chạy chung 1 lần.
+    - Model chạy trên 1 thread riêng → event loop của FastAPI không bị chặn.
+    - Mỗi request nhận kết quả qua Future riêng.
+    """
+
+    def __init__(self, detector, embedder, max_batch=16, max_wait_ms=8, max_queue=64):
+        self.detector = detector
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats = {"detect": _BatchStats(), "embed": _BatchStats()}
+        self._thread = threading.Thread(target=self._worker, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    # ====== API ======
+    def submit_detect(self, frame):
+        return self._submit("detect", frame)
+
+    def submit_embed(self, crops):
+        return self._submit("embed", list(crops))
+
+    async def detect(self, frame):
+        """(boxes N×5, keypoints N×5×2 hoặc None) — landmark dùng để căn chỉnh khuôn mặt."""
+        return await asyncio.wrap_future(self.submit_detect(frame))
+
+    async def embed(self, crops):
+        if len(crops) == 0:
+            return np.empty((0, 512), dtype=np.float32)
+        return await asyncio.wrap_future(self.submit_embed(crops))
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "queue_size": self._queue.qsize(),
+            "detect": self._stats["detect"].as_dict(),
+            "embed": self._stats["embed"].as_dict(),
+        }
+
+    def _submit(self, kind, payload):
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            raise ServerBusy("Hàng đợi suy luận đã đầy, thử lại sau")
+        job = _Job(kind, payload)
+        self._queue.put(job)
+        return job.future
+
+    # ====== WORKER ======
+    def _collect(self):
+        jobs = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(jobs) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                jobs.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _worker(self):
+        while True:
+            jobs = self._collect()
+            for kind in ("detect", "embed"):
+                batch = [j for j in jobs if j.kind == kind]
+                if batch:
+                    getattr(self, f"_run_{kind}")(batch)
+
+    def _run_detect(self, jobs):
+        t0 = time.perf_counter()
+        try:
+            results = self.detector.detect_batch([j.payload for j in jobs], landmarks=True)
+        except Exception as e:
+            for j in jobs:
+                j.future.set_exception(e)
+            return
+        self._stats["detect"].record(jobs, len(jobs), (time.perf_counter() - t0) * 1000, t0)
+        for j, result in zip(jobs, results):
+            j.future.set_result(result)
+
+    def _run_embed(self, jobs):
+        crops = [c for j in jobs for c in j.payload]
+        t0 = time.perf_counter()
+        try:
+            embs = self.embedder.get_batch(crops)
+        except Exception as e:
+            for j in jobs:
+                j.future.set_exception(e)
+            return
+        self._stats["embed"].record(jobs, len(crops), (time.perf_counter() - t0) * 1000, t0)
+        start = 0
+        for j in jobs:
+            end = start + len(j.payload)
+            j.future.set_result(embs[start:end])
+            start = end
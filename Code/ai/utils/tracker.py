@@ -0,0 +1,174 @@
+# utils/tracker.py
+import itertools
+import time
+import cv2
+import numpy as np
+
+from utils import config
+
+TRACKING_DEFAULTS = {
+    "detect_every": 5,      # chạy detector mỗi N frame; frame ở giữa bám theo optical flow
+    "iou_threshold": 0.3,   # box detect mới ghép với track cũ khi IoU ≥ ngưỡng
+    "max_missed": 1,        # số lần detect liên tiếp không thấy track trước khi bỏ
+    "min_points": 6,        # điểm optical flow còn bám được tối thiểu, ít hơn → detect lại ngay
+    "reembed_age_s": 2.0,   # danh tính cache quá thời gian này → embed lại
+    "reembed_gain": 0.2,    # chất lượng mặt tăng > 20% so với lúc embed → embed lại
+}
+
+
+def iou_matrix(a, b):
+    """IoU giữa 2 tập box (N×4+, M×4+)."""
+    a, b = np.asarray(a, dtype=np.float32)[:, :4], np.asarray(b, dtype=np.float32)[:, :4]
+    iw = np.clip(np.minimum(a[:, None, 2], b[:, 2]) - np.maximum(a[:, None, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, None, 3], b[:, 3]) - np.maximum(a[:, None, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b - inter + 1e-9)
+
+
+class Track:
+    """1 khuôn mặt được bám qua nhiều frame + danh tính đã nhận diện (cache)."""
+
+    __slots__ = ("id", "box", "kpts", "points", "missed", "quality",
+                 "identity", "embedded_quality", "embedded_at")
+
+    def __init__(self, track_id, box, kpts=None):
+        self.id = track_id
+        self.missed = 0
+        self.points = None
+        self.identity = None
+        self.embedded_quality = 0.0
+        self.embedded_at = 0.0
+        self.set_detection(box, kpts)
+
+    def set_detection(self, box, kpts=None):
+        self.box = np.asarray(box, dtype=np.float32).copy()
+        self.kpts = None if kpts is None else np.asarray(kpts, dtype=np.float32).copy()
+        # Chất lượng ước lượng từ detect (không cần crop): conf × cạnh ngắn của box
+        self.quality = float(self.box[4]) * float(min(self.box[2] - self.box[0], self.box[3] - self.box[1]))
+
+    def shift(self, dx, dy):
+        self.box[:4] += (dx, dy, dx, dy)
+        if self.kpts is not None:
+            self.kpts += (dx, dy)
+
+    def needs_embedding(self, max_age_s, min_gain, now=None):
+        """Chưa có danh tính, danh tính quá cũ, hoặc mặt rõ hơn đáng kể so với lúc embed."""
+        now = time.monotonic() if now is None else now
+        return (self.identity is None
+                or now - self.embedded_at > max_age_s
+                or self.quality > self.embedded_quality * (1 + min_gain))
+
+    def remember(self, identity, now=None):
+        self.identity = identity
+        self.embedded_quality = self.quality
+        self.embedded_at = time.monotonic() if now is None else now
+
+
+class FaceTracker:
+    """
+    Bám khuôn mặt cho vòng lặp webcam:
+    - Detector chỉ chạy mỗi detect_every frame, khi chưa có track hoặc khi optical flow mất dấu
+    - Frame ở giữa: dịch box + landmark theo trung vị chuyển động optical flow (Lucas-Kanade)
+      của các điểm đặc trưng trong box
+    - Lúc detect: ghép box mới với track cũ theo IoU → track giữ id và danh tính đã cache
+    """
+
+    def __init__(self, detector, **opts):
+        self.detector = detector
+        self.opts = dict(TRACKING_DEFAULTS, **opts)
+        self.tracks = []
+        self.frames = 0
+        self.detections = 0
+        self._ids = itertools.count()
+        self._since_detect = 0
+        self._prev_gray = None
+
+    @classmethod
+    def from_config(cls, detector):
+        return cls(detector, **{k: config.get("tracking", k, v) for k, v in TRACKING_DEFAULTS.items()})
+
+    def forget(self):
+        """Xóa danh tính đã cache của mọi track (vd. gallery vừa đổi version)."""
+        for track in self.tracks:
+            track.identity = None
+
+    def update(self, frame):
+        """Cập nhật track theo frame mới; trả về danh sách Track hiện có."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.frames += 1
+        need_detect = not self.tracks or self._since_detect + 1 >= self.opts["detect_every"]
+        if not need_detect:
+            need_detect = not self._flow(gray)
+        if need_detect:
+            self._detect(frame, gray)
+        else:
+            self._since_detect += 1
+        self._prev_gray = gray
+        return self.tracks
+
+    def _detect(self, frame, gray):
+        boxes, kpts = self.detector.detect(frame, landmarks=True)
+        self.detections += 1
+        self._since_detect = 0
+        matched = set()
+        if len(self.tracks) and len(boxes):
+            iou = iou_matrix([t.box for t in self.tracks], boxes)
+            # Ghép tham lam theo IoU lớn nhất
+            for ti, di in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[ti, di] < self.opts["iou_threshold"]:
+                    break
+                track = self.tracks[ti]
+                if track.missed < 0 or di in matched:
+                    continue
+                track.set_detection(boxes[di], None if kpts is None else kpts[di])
+                track.missed = -1  # đánh dấu đã ghép trong lần detect này
+                matched.add(di)
+        kept = []
+        for track in self.tracks:
+            if track.missed < 0:
+                track.missed = 0
+                kept.append(track)
+            elif track.missed + 1 <= self.opts["max_missed"]:
+                track.missed += 1
+                kept.append(track)
+        for di in range(len(boxes)):
+            if di not in matched:
+                kept.append(Track(next(self._ids), boxes[di], None if kpts is None else kpts[di]))
+        self.tracks = kept
+        for track in self.tracks:
+            track.points = self._features(gray, track.box)
+
+    def _features(self, gray, box):
+        h, w = gray.shape
+        x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+        x2, y2 = min(int(box[2]), w), min(int(box[3]), h)
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return None
+        mask = np.zeros_like(gray)
+        mask[y1:y2, x1:x2] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)
+
+    def _flow(self, gray):
+        """Dịch mọi track theo optical flow; False nếu có track mất dấu (cần detect lại)."""
+        for track in self.tracks:
+            if track.missed or track.points is None or len(track.points) < self.opts["min_points"]:
+                return False
+            new, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None,
+                                                      winSize=(15, 15), maxLevel=2)
+            good = status.ravel() == 1
+            if good.sum() < self.opts["min_points"]:
+                return False
+            dx, dy = np.median((new[good] - track.points[good]).reshape(-1, 2), axis=0)
+            track.shift(float(dx), float(dy))
+            track.points = new[good].reshape(-1, 1, 2)
+        return True
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "detections": self.detections,
+            "detect_ratio": round(self.detections / self.frames, 3) if self.frames else 0,
+            "tracks": len(self.tracks),
+        }
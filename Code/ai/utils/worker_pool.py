@@ -0,0 +1,373 @@
+# utils/worker_pool.py
+import asyncio
+import atexit
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection, shared_memory
+
+import numpy as np
+
+from utils.executor import ServerBusy
+
+CHECK_INTERVAL_S = 1.0  # chu kỳ kiểm tra worker còn sống + job quá hạn (không phụ thuộc hàng đợi kết quả)
+
+
+def split_cpus(workers, affinity="auto"):
+    """
+    Danh sách CPU cho từng worker:
+    - auto : chia đều các core process đang được phép dùng thành workers nhóm liền nhau
+    - none : không ghim CPU
+    - list : chỉ định tay, vd. [[0, 1], [2, 3]]
+    """
+    if affinity in (None, "none") or not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    if isinstance(affinity, (list, tuple)):
+        return [list(affinity[i % len(affinity)]) for i in range(workers)]
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < workers:
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    return [[int(c) for c in chunk] for chunk in np.array_split(cpus, workers)]
+
+
+def _reply(send, job_id, future):
+    e = future.exception()
+    if e is not None:
+        # Exception của model có thể không pickle được → gửi về dạng chuỗi
+        send((job_id, None, f"{type(e).__name__}: {e}"))
+    else:
+        send((job_id, future.result(), None))
+
+
+def _worker_main(index, cpus, jobs, conn, slot_names, scheduler_opts):
+    """Process worker: nạp model 1 lần, đọc frame/crop thẳng từ shared memory, gom lô như scheduler."""
+    from functools import partial
+    from utils import config
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        # ORT mặc định tạo thread theo số core của máy → giới hạn theo số core được ghim
+        if not config.get("onnxruntime", "intra_op_threads", 0):
+            config.override("onnxruntime", "intra_op_threads", len(cpus))
+    from utils.model_registry import get_detector, get_embedder
+    from utils.scheduler import InferenceScheduler
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    detector, embedder = get_detector(), get_embedder()
+    detector.detect(np.zeros((240, 320, 3), dtype=np.uint8))
+    embedder.get(np.zeros((112, 112, 3), dtype=np.uint8))
+    scheduler = InferenceScheduler(detector, embedder, max_queue=0, **scheduler_opts)
+
+    # Kết quả gửi từ thread suy luận của scheduler → khóa trong process để không trộn tin nhắn
+    send_lock = threading.Lock()
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    send(("ready", index, os.getpid()))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, kind, slot, shape, payload = job
+        if slot is not None:
+            payload = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+        future = scheduler.submit_detect(payload) if kind == "detect" else scheduler.submit_embed(payload)
+        future.add_done_callback(partial(_reply, send, job_id))
+
+    for shm in slots:
+        shm.close()
+
+
+class WorkerPool:
+    """
+    Chạy detect/embed trên N process worker, mỗi worker giữ 1 bộ model và gom lô riêng.
+    - Frame/crop đã decode được chép vào các slot multiprocessing.shared_memory cấp sẵn;
+      hàng đợi chỉ mang mô tả job (id, loại, slot, shape) → không pickle ảnh
+    - Mỗi worker có hàng đợi job + pipe kết quả riêng: process chính giao job cho worker sẵn sàng
+      đang giữ ít job nhất nên biết chính xác job nào nằm ở worker nào. Worker bị kill không làm
+      kẹt khóa của hàng đợi dùng chung, và chỉ job của chính nó bị hủy
+    - Worker chết: pipe kết quả báo EOF ngay, is_alive() kiểm tra thêm theo chu kỳ
+    - Kết quả (boxes/keypoints/embedding, vài KB) trả về qua pipe kết quả
+    - Không còn slot trống hoặc ảnh lớn hơn slot → gửi thẳng mảng qua hàng đợi (đếm pickled)
+    - Cùng API với InferenceScheduler (detect/embed/submit_*/stats) → router không phải đổi
+    """
+
+    def __init__(self, workers=2, cpu_affinity="auto", slots=8, slot_mb=4,
+                 max_batch=16, max_wait_ms=8, max_queue=64, job_timeout_s=30, start_timeout=300):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_timeout_s = job_timeout_s
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.shm_jobs = 0
+        self.pickled_jobs = 0
+        self.restarts = 0
+        self.failed_jobs = 0
+        self.timed_out_jobs = 0
+        self._ctx = mp.get_context("spawn")
+        self._cpus = split_cpus(workers, cpu_affinity)
+        self._scheduler_opts = {"max_batch": max_batch, "max_wait_ms": max_wait_ms}
+        self._shm = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(slots)]
+        self._free = queue.Queue()
+        for i in range(slots):
+            self._free.put(i)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}   # job_id → [future, slot, worker giữ job, lúc gửi]
+        self._orphans = {}   # job_id → (slot, worker) của job đã hủy vì quá hạn; trả slot khi có kết quả
+        self._inflight = [0] * workers
+        self._ready = {}     # worker → pid, chỉ worker sẵn sàng mới được giao job
+        self._all_ready = threading.Event()
+        self._started = False
+        self._closed = False
+        self._procs = [None] * workers
+        self._jobs = [None] * workers
+        self._conns = [None] * workers
+        for i in range(workers):
+            self._spawn(i)
+        self._reader = threading.Thread(target=self._read_results, name="worker-pool", daemon=True)
+        self._reader.start()
+        atexit.register(self.close)
+        self._wait_ready(start_timeout)
+
+    def _spawn(self, index):
+        jobs = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(
+            target=_worker_main, name=f"face-worker-{index}", daemon=True,
+            args=(index, self._cpus[index], jobs, writer, [s.name for s in self._shm], self._scheduler_opts))
+        p.start()
+        writer.close()  # chỉ worker giữ đầu ghi → worker chết thì reader nhận EOF
+        self._procs[index], self._jobs[index], self._conns[index] = p, jobs, reader
+
+    def _wait_ready(self, timeout):
+        if not self._all_ready.wait(timeout) or len(self._ready) < self.workers:
+            self.close()
+            raise RuntimeError(f"Worker không khởi động được (sẵn sàng {len(self._ready)}/{self.workers})")
+        self._started = True
+        print(f"[POOL] {self.workers} worker sẵn sàng, CPU: {self._cpus}")
+
+    # ====== API (giống InferenceScheduler) ======
+    def submit_detect(self, frame):
+        return self._submit("detect", np.ascontiguousarray(frame, dtype=np.uint8))
+
+    def submit_embed(self, crops):
+        return self._submit("embed", list(crops))
+
+    async def detect(self, frame):
+        """(boxes N×5, keypoints N×5×2 hoặc None) — landmark dùng để căn chỉnh khuôn mặt."""
+        return await asyncio.wrap_future(self.submit_detect(frame))
+
+    async def embed(self, crops):
+        if len(crops) == 0:
+            return np.empty((0, 512), dtype=np.float32)
+        return await asyncio.wrap_future(self.submit_embed(crops))
+
+    def stats(self):
+        return {
+            "mode": "workers",
+            "workers": [{"pid": p.pid, "alive": p.is_alive(), "ready": i in self._ready,
+                         "inflight": self._inflight[i], "cpus": cpus}
+                        for i, (p, cpus) in enumerate(zip(self._procs, self._cpus))],
+            "max_queue": self.max_queue,
+            "pending": len(self._pending),
+            "slots": len(self._shm),
+            "free_slots": self._free.qsize(),
+            "slot_mb": round(self.slot_bytes / (1024 * 1024), 1),
+            "shm_jobs": self.shm_jobs,
+            "pickled_jobs": self.pickled_jobs,
+            "restarts": self.restarts,
+            "failed_jobs": self.failed_jobs,
+            "timed_out_jobs": self.timed_out_jobs,
+        }
+
+    # ====== NỘI BỘ ======
+    def _to_slot(self, payload):
+        """Chép payload (1 frame hoặc list crop cùng shape) vào 1 slot trống; None nếu không được."""
+        if isinstance(payload, list):
+            if not payload or any(c.shape != payload[0].shape for c in payload):
+                return None, None
+            shape = (len(payload),) + payload[0].shape
+        else:
+            shape = payload.shape
+        if int(np.prod(shape)) > self.slot_bytes:
+            return None, None
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            return None, None
+        view = np.ndarray(shape, dtype=np.uint8, buffer=self._shm[slot].buf)
+        if isinstance(payload, list):
+            for dst, crop in zip(view, payload):
+                dst[...] = crop
+        else:
+            view[...] = payload
+        return slot, shape
+
+    def _submit(self, kind, payload):
+        if self.max_queue and len(self._pending) >= self.max_queue:
+            raise ServerBusy("Hàng đợi suy luận đã đầy, thử lại sau")
+        slot, shape = self._to_slot(payload)
+        future = Future()
+        job_id = next(self._ids)
+        with self._lock:
+            ready = list(self._ready)
+            if not ready:
+                if slot is not None:
+                    self._free.put(slot)
+                raise ServerBusy("Không có worker suy luận sẵn sàng, thử lại sau")
+            # Giao cho worker đang giữ ít job nhất (trong khóa → không giao vào worker vừa bị đánh dấu chết)
+            worker = min(ready, key=self._inflight.__getitem__)
+            self._inflight[worker] += 1
+            self._pending[job_id] = [future, slot, worker, time.monotonic()]
+            jobs = self._jobs[worker]
+        if slot is None:
+            self.pickled_jobs += 1
+            jobs.put((job_id, kind, None, None, payload))
+        else:
+            self.shm_jobs += 1
+            jobs.put((job_id, kind, slot, shape, None))
+        return future
+
+    def _finish(self, job_id, free_slot=True):
+        """Bỏ job khỏi _pending, trả slot (nếu free_slot); trả về (future, slot) hoặc None."""
+        with self._lock:
+            entry = self._pending.pop(job_id, None)
+            if entry is None:
+                return None
+            future, slot, worker, _ = entry
+            self._inflight[worker] -= 1
+        if slot is not None and free_slot:
+            self._free.put(slot)
+        return future, slot
+
+    def _read_results(self):
+        """Thread duy nhất nhận kết quả + set future (kể cả khi hủy job) → không tranh chấp giữa các nhánh."""
+        next_check = time.monotonic() + CHECK_INTERVAL_S
+        while not self._closed:
+            conns = {c: i for i, c in enumerate(self._conns) if c is not None}
+            try:
+                readable = connection.wait(list(conns), timeout=CHECK_INTERVAL_S) if conns else []
+            except OSError:
+                return
+            for conn in readable:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    self._on_worker_exit(conns[conn])
+                    continue
+                self._handle(msg)
+            if not conns:
+                time.sleep(CHECK_INTERVAL_S)
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + CHECK_INTERVAL_S
+                for i, p in enumerate(self._procs):
+                    if not p.is_alive() and self._conns[i] is not None:
+                        self._on_worker_exit(i)
+                self._expire_jobs()
+
+    def _handle(self, msg):
+        if msg[0] == "ready":
+            with self._lock:
+                self._ready[msg[1]] = msg[2]
+            if len(self._ready) >= self.workers:
+                self._all_ready.set()
+            return
+        job_id, result, error = msg
+        entry = self._finish(job_id)
+        if entry is None:
+            with self._lock:
+                orphan = self._orphans.pop(job_id, None)
+            if orphan is not None:
+                self._free.put(orphan[0])
+            return
+        future = entry[0]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future, message):
+        if not future.done():
+            future.set_exception(RuntimeError(message))
+
+    def _on_worker_exit(self, index):
+        """Worker chết (OOM, crash model) → chỉ hủy job worker đó đang giữ, khởi động lại worker."""
+        if self._closed:
+            return
+        p = self._procs[index]
+        p.join(1.0)
+        with self._lock:
+            # Ngừng giao job cho worker này trước khi gom job của nó
+            self._ready.pop(index, None)
+            job_ids = [job_id for job_id, entry in self._pending.items() if entry[2] == index]
+            orphans = [job_id for job_id, (_, worker) in self._orphans.items() if worker == index]
+            orphan_slots = [self._orphans.pop(job_id)[0] for job_id in orphans]
+        self._conns[index].close()
+        self._conns[index] = None
+        if not self._started:
+            # Lỗi lúc nạp model (thiếu file, sai config) → báo ngay, không khởi động lại vô hạn
+            print(f"[POOL] worker {index} dừng khi khởi động (mã {p.exitcode})")
+            self._all_ready.set()
+            return
+        print(f"[POOL] worker {index} (pid {p.pid}) dừng với mã {p.exitcode}, "
+              f"hủy {len(job_ids)} job đang giữ, khởi động lại")
+        # Worker đã chết → không còn ai đọc slot của các job này, trả slot về được
+        for job_id in job_ids:
+            entry = self._finish(job_id)
+            if entry is not None:
+                self.failed_jobs += 1
+                self._fail(entry[0], "Worker suy luận bị dừng")
+        for slot in orphan_slots:
+            self._free.put(slot)
+        self._spawn(index)
+        self.restarts += 1
+
+    def _expire_jobs(self):
+        """
+        Job chưa có kết quả sau job_timeout_s (worker treo) → báo lỗi cho request, bỏ khỏi _pending.
+        Slot chưa trả ngay: worker có thể vẫn đang đọc → trả khi worker gửi kết quả hoặc khi worker chết.
+        """
+        if not self.job_timeout_s:
+            return
+        deadline = time.monotonic() - self.job_timeout_s
+        with self._lock:
+            stale = [(job_id, entry[2]) for job_id, entry in self._pending.items() if entry[3] < deadline]
+        for job_id, worker in stale:
+            entry = self._finish(job_id, free_slot=False)
+            if entry is None:
+                continue
+            future, slot = entry
+            if slot is not None:
+                with self._lock:
+                    self._orphans[job_id] = (slot, worker)
+            self.timed_out_jobs += 1
+            self._fail(future, "Quá thời gian chờ worker suy luận")
+
+    def close(self, timeout=5.0):
+        """Dừng worker và giải phóng shared memory."""
+        if self._closed:
+            return
+        self._closed = True
+        for jobs in self._jobs:
+            jobs.put(None)
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        for conn in self._conns:
+            if conn is not None:
+                conn.close()
+        for shm in self._shm:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
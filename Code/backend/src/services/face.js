@@ -9,22 +9,33 @@ class FaceService {
     this.aiServiceUrl = process.env.AI_SERVICE_URL || "http://localhost:8000"
   }
 
-  // Extract embedding from image using AI service
-  async extractEmbedding(imageBuffer) {
+  // Decode base64 little-endian float32 embedding returned by AI service
+  decodeEmbedding(base64Embedding) {
+    const buffer = Buffer.from(base64Embedding, "base64")
+    const embedding = new Array(buffer.length / 4)
+    for (let i = 0; i < embedding.length; i++) {
+      embedding[i] = buffer.readFloatLE(i * 4)
+    }
+    return embedding
+  }
+
+  // Extract embeddings for many images in one request (null for images without a face)
+  async extractEmbeddings(imageBuffers) {
     try {
       const formData = new FormData()
-      formData.append("file", imageBuffer, { filename: "image.jpg" })
+      imageBuffers.forEach((buffer, i) => {
+        formData.append("files", buffer, { filename: `image_${i}.jpg` })
+      })
+      formData.append("dtype", "float32")
 
       const response = await axios.post(`${this.aiServiceUrl}/api/extract-embedding`, formData, {
         headers: formData.getHeaders(),
         timeout: 30000,
       })
 
-      if (response.data && response.data.embedding) {
-        return response.data.embedding
-      }
-
-      throw new Error("No embedding returned from AI service")
+      return response.data.results.map((result) =>
+        result.status === "success" ? this.decodeEmbedding(result.embedding) : null,
+      )
     } catch (error) {
       console.error("Error extracting embedding:", error.message)
       if (error.code === "ECONNREFUSED") {
@@ -34,11 +45,23 @@ class FaceService {
     }
   }
 
+  // Extract embedding from image using AI service
+  async extractEmbedding(imageBuffer) {
+    const [embedding] = await this.extractEmbeddings([imageBuffer])
+    if (!embedding) {
+      throw new Error("No embedding returned from AI service")
+    }
+    return embedding
+  }
+
   // Register face images for user (5-20 images)
   async registerFaceImages(userId, images) {
     const embeddings = []
 
-    for (const image of images) {
+    // Extract all embeddings from Python AI service in a single request
+    const extracted = await this.extractEmbeddings(images.map((image) => image.buffer))
+
+    for (const [i, image] of images.entries()) {
       try {
         // Save image to storage
         const imageUrl = await this.saveImage(image, userId)
@@ -50,25 +73,15 @@ class FaceService {
         )
         const imageId = result.insertId
 
-        // Extract embedding from Python AI service
-        const formData = new FormData()
-        formData.append("file", image.buffer, { filename: "image.jpg" })
-
-        const response = await axios.post(`${this.aiServiceUrl}/api/verify`, formData, {
-          headers: formData.getHeaders(),
-        })
-
-        if (response.data.status === "success" && response.data.faces.length > 0) {
-          const faceData = response.data.faces[0]
-
+        if (extracted[i]) {
           // Save embedding to database
           await pool.execute("INSERT INTO face_embeddings (user_id, source_image_id, embedding) VALUES (?, ?, ?)", [
             userId,
             imageId,
-            JSON.stringify(faceData.embedding || []),
+            JSON.stringify(extracted[i]),
           ])
 
-          embeddings.push({ imageId, score: faceData.score })
+          embeddings.push({ imageId })
         }
       } catch (error) {
         console.error("Error processing image:", error)